@@ -0,0 +1,68 @@
+"""Compare the TensorFlow and NumPy Binary backends: steps/sec and the
+argmax-channel loss curves over several seeds.
+
+Run from the repository root with `python -m benchmarks.backends [seeds]`.
+"""
+import sys
+import tempfile
+
+import numpy as np
+import tensorflow as tf
+
+from emergence.model.binary import Binary
+from emergence.model.numpy_binary import NumpyBinary
+
+CFG = {
+    'epochs': 3000,
+    'num_concepts': 6,
+    'e_dense_size': 20,
+    'sentence_len': 6,
+}
+
+
+def tf_run(cfg):
+    """Train the TF model and return steps/sec and the (train, test) loss
+    at each superepoch."""
+    with tempfile.TemporaryDirectory() as logdir:
+        model = Binary(cfg=cfg, logdir=logdir)
+        curve = []
+        write_summaries = model.write_summaries
+
+        def record(superepoch, verbose=False):
+            metrics = write_summaries(superepoch, verbose)
+            curve.append((metrics['train']['loss'], metrics['test']['loss']))
+            return metrics
+
+        model.write_summaries = record
+        model.run()
+        rate = model.steps_per_sec
+        model.sess.close()
+    tf.reset_default_graph()
+    return rate, np.array(curve)
+
+
+def numpy_run(cfg):
+    model = NumpyBinary(cfg={**cfg, 'summary_sink': None})
+    model.run()
+    curve = np.array([(train, test) for _, train, test in model.history])
+    return model.steps_per_sec, curve
+
+
+if __name__ == '__main__':
+    seeds = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    results = {}
+    for name, fn in [('tf', tf_run), ('numpy', numpy_run)]:
+        runs = [fn({**CFG, 'seed': seed}) for seed in range(seeds)]
+        rates = np.array([rate for rate, _ in runs])
+        curves = np.stack([curve for _, curve in runs])
+        results[name] = rates, curves
+        print(f"{name}\t{rates.mean():.1f} steps/sec")
+
+    speedup = results['numpy'][0].mean() / results['tf'][0].mean()
+    print(f"numpy speedup {speedup:.2f}x")
+    print("superepoch\ttf train (mean±std)\tnumpy train (mean±std)")
+    tf_curves, np_curves = results['tf'][1], results['numpy'][1]
+    for i in range(tf_curves.shape[1]):
+        tf_l, np_l = tf_curves[:, i, 0], np_curves[:, i, 0]
+        print(f"{i}\t{tf_l.mean():.3f}±{tf_l.std():.3f}\t"
+              f"{np_l.mean():.3f}±{np_l.std():.3f}")
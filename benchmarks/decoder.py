@@ -0,0 +1,76 @@
+"""Compare the tiled and einsum per-position decoder layers in Binary for
+growing batch_size and sentence_len: forward/backward time and the bytes
+allocated by each step.
+
+Run from the repository root with `python -m benchmarks.decoder`.
+"""
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from emergence.model.binary import Binary
+
+VOCAB_SIZE = 2
+D_DENSE_SIZE = 8
+STEPS = 50
+
+
+class Decoder:
+    """Just enough of Binary for Binary.decode's per-position layer."""
+
+    def __init__(self, cfg):
+        self.cfg = cfg
+        self.d_fc_w = tf.Variable(tf.random_normal(
+            (1, cfg['vocab_size'], cfg['d_dense_size'])))
+        self.d_fc_b = tf.Variable(tf.random_normal(
+            (cfg['sentence_len'], 1, cfg['d_dense_size'])))
+        self.decoder_layers = [tf.keras.layers.Flatten()]
+
+    decode = Binary.decode
+    decode_positions_tiled = Binary.decode_positions_tiled
+
+
+def measure(decoder, batch_size, sentence_len):
+    cfg = {
+        'decoder': decoder,
+        'vocab_size': VOCAB_SIZE,
+        'd_dense_size': D_DENSE_SIZE,
+        'sentence_len': sentence_len,
+    }
+    with tf.Graph().as_default():
+        model = Decoder(cfg)
+        utt = tf.placeholder(tf.float32, (None, sentence_len, VOCAB_SIZE))
+        out = model.decode(utt)
+        grads = tf.gradients(tf.reduce_sum(out), [model.d_fc_w, model.d_fc_b])
+        fd = {utt: np.random.rand(batch_size, sentence_len, VOCAB_SIZE)}
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            sess.run(grads, feed_dict=fd)
+            start = time.perf_counter()
+            for _ in range(STEPS):
+                sess.run(grads, feed_dict=fd)
+            elapsed = (time.perf_counter() - start) / STEPS
+
+            metadata = tf.RunMetadata()
+            sess.run(grads, feed_dict=fd,
+                    options=tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE),
+                    run_metadata=metadata)
+    allocated = sum(
+            output.tensor_description.allocation_description.requested_bytes
+            for dev in metadata.step_stats.dev_stats
+            for node in dev.node_stats
+            for output in node.output)
+    return elapsed, allocated
+
+
+if __name__ == '__main__':
+    print("batch_size\tsentence_len\t"
+          "tile ms\teinsum ms\ttile MB\teinsum MB")
+    for batch_size in [64, 512, 4096]:
+        for sentence_len in [4, 16, 64]:
+            tile_t, tile_b = measure('tile', batch_size, sentence_len)
+            ein_t, ein_b = measure('einsum', batch_size, sentence_len)
+            print(f"{batch_size}\t{sentence_len}\t"
+                  f"{tile_t * 1e3:.2f}\t{ein_t * 1e3:.2f}\t"
+                  f"{tile_b / 2**20:.2f}\t{ein_b / 2**20:.2f}")
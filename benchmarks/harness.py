@@ -0,0 +1,186 @@
+"""Throughput and memory benchmarks for BinaryModel and OneHotModel.
+
+Every point of a grid over num_concepts, batch_size, sentence_len,
+vocab_size and the dense sizes trains for a fixed number of steps in a fresh
+process. Each result records steps/sec, graph construction time, permutation
+and split time (Binary only) and peak RSS, one JSON object per line.
+
+    python -m benchmarks.harness run results.jsonl [--steps N] [--quick]
+    python -m benchmarks.harness compare old.jsonl new.jsonl [--threshold 0.1]
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import resource
+import sys
+import tempfile
+import time
+
+GRID = {
+    'num_concepts': [6, 10, 14],
+    'batch_size': [1, 7],
+    'sentence_len': [4, 8],
+    'vocab_size': [2, 4],
+    'dense_size': [8, 32],
+}
+
+QUICK_GRID = {
+    'num_concepts': [6],
+    'batch_size': [4],
+    'sentence_len': [6],
+    'vocab_size': [2],
+    'dense_size': [20],
+}
+
+# Metric name -> whether larger is better
+METRICS = {
+    'steps_per_sec': True,
+    'construct_sec': False,
+    'permutations_sec': False,
+    'split_sec': False,
+    'peak_rss_mb': False,
+}
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def bench_binary(point, steps):
+    from emergence.model.binary import Binary
+
+    cfg = {
+        'epochs': steps,
+        'num_concepts': point['num_concepts'],
+        'batch_size': point['batch_size'],
+        'sentence_len': point['sentence_len'],
+        'vocab_size': point['vocab_size'],
+        'e_dense_size': point['dense_size'],
+        'd_dense_size': point['dense_size'],
+        'seed': 0,
+    }
+    start = time.perf_counter()
+    arr = Binary.permutations(cfg['num_concepts'])
+    permutations_sec = time.perf_counter() - start
+    start = time.perf_counter()
+    Binary.train_test_split(arr, Binary.default_cfg['test_prop'], seed=0)
+    split_sec = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as logdir:
+        start = time.perf_counter()
+        model = Binary(cfg=cfg, logdir=logdir)
+        construct_sec = time.perf_counter() - start
+        model.run()
+    return {
+        'steps_per_sec': model.steps_per_sec,
+        'construct_sec': construct_sec,
+        'permutations_sec': permutations_sec,
+        'split_sec': split_sec,
+    }
+
+
+def bench_one_hot(point, steps):
+    from emergence.model.one_hot import OneHot, default_config
+
+    cfg = {
+        **default_config,
+        'epochs': steps,
+        'num_concepts': point['num_concepts'],
+        'batch_size': point['batch_size'],
+        'sentence_len': point['sentence_len'],
+        'vocab_size': point['vocab_size'],
+        'e_dense_size': point['dense_size'],
+        'd_dense_size': point['dense_size'],
+    }
+    start = time.perf_counter()
+    model = OneHot(cfg)
+    construct_sec = time.perf_counter() - start
+    start = time.perf_counter()
+    model.run()
+    return {
+        'steps_per_sec': steps / (time.perf_counter() - start),
+        'construct_sec': construct_sec,
+    }
+
+
+MODELS = {'binary': bench_binary, 'one_hot': bench_one_hot}
+
+
+def bench(args):
+    model, point, steps = args
+    result = MODELS[model](point, steps)
+    return {
+        'model': model,
+        **point,
+        'steps': steps,
+        **result,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def run(path, grid, steps):
+    points = [dict(zip(grid, values))
+            for values in itertools.product(*grid.values())]
+    jobs = [(model, point, steps) for model in MODELS for point in points]
+    # A fresh process per point so that peak RSS is per point
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1, maxtasksperchild=1) as pool, open(path, 'w') as f:
+        for result in pool.imap(bench, jobs):
+            f.write(json.dumps(result) + '\n')
+            f.flush()
+            print(json.dumps(result))
+
+
+def point_key(result):
+    return tuple((k, result[k]) for k in ['model', 'steps'] + list(GRID))
+
+
+def load(path):
+    with open(path) as f:
+        return {point_key(r): r for r in map(json.loads, f) if r}
+
+
+def compare(old_path, new_path, threshold):
+    """Print every metric which got worse by more than `threshold`
+    (relative) and return the number of regressions."""
+    old, new = load(old_path), load(new_path)
+    regressions = 0
+    for key in sorted(set(old) & set(new), key=str):
+        for metric, larger_is_better in METRICS.items():
+            if metric not in old[key] or metric not in new[key]:
+                continue
+            a, b = old[key][metric], new[key][metric]
+            if not a:
+                continue
+            change = (b - a) / a
+            worse = -change if larger_is_better else change
+            if worse > threshold:
+                regressions += 1
+                point = ', '.join(f'{k}={v}' for k, v in key)
+                print(f"REGRESSION {metric}: {a:.4g} -> {b:.4g} "
+                      f"({change:+.1%})\t{point}")
+    print(f"{len(set(old) & set(new))} points compared, "
+          f"{regressions} regressions")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run')
+    run_parser.add_argument('out')
+    run_parser.add_argument('--steps', type=int, default=500)
+    run_parser.add_argument('--quick', action='store_true')
+    compare_parser = commands.add_parser('compare')
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.1)
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        run(args.out, QUICK_GRID if args.quick else GRID, args.steps)
+    else:
+        sys.exit(1 if compare(args.old, args.new, args.threshold) else 0)
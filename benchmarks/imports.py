@@ -0,0 +1,51 @@
+"""Time importing the package and its TensorFlow-free modules, each in a
+fresh interpreter, and check which of them load TensorFlow.
+
+Run from the repository root with `python -m benchmarks.imports [--repeats N]`.
+"""
+import argparse
+import subprocess
+import sys
+
+MODULES = [
+    'emergence',
+    'emergence.util',
+    'emergence.space',
+    'emergence.lexicon',
+    'emergence.metrics',
+    'emergence.data',
+    'emergence.cache',
+    'emergence.agent_pair',
+    'emergence.model.numpy_binary',
+    'emergence.model.binary',
+]
+
+SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start, 'tensorflow' in sys.modules)
+"""
+
+
+def time_import(module):
+    out = subprocess.run([sys.executable, '-c', SCRIPT.format(module=module)],
+            capture_output=True, text=True, check=True).stdout.split()
+    return float(out[0]), out[1] == 'True'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'module':<32}{'best (ms)':>12}  loads tensorflow")
+    for module in MODULES:
+        try:
+            results = [time_import(module) for _ in range(args.repeats)]
+        except subprocess.CalledProcessError as e:
+            print(f"{module:<32}{'failed':>12}  {e.stderr.splitlines()[-1]}")
+            continue
+        best = min(seconds for seconds, _ in results)
+        print(f"{module:<32}{best * 1e3:>12.1f}  {results[0][1]}")
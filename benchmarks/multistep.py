@@ -0,0 +1,37 @@
+"""Compare Binary training throughput with one session call per step against
+the on-device multi-step loop.
+
+Run from the repository root with `python -m benchmarks.multistep [epochs]`.
+"""
+import sys
+import tempfile
+
+import tensorflow as tf
+
+from emergence.model.binary import Binary
+
+
+def steps_per_sec(cfg):
+    with tempfile.TemporaryDirectory() as logdir:
+        model = Binary(cfg=cfg, logdir=logdir)
+        model.run()
+        rate = model.steps_per_sec
+        model.sess.close()
+    tf.reset_default_graph()
+    return rate
+
+
+if __name__ == '__main__':
+    epochs = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    cfg = {
+        'epochs': epochs,
+        'num_concepts': 6,
+        'e_dense_size': 20,
+        'sentence_len': 6,
+    }
+    base = steps_per_sec({**cfg, 'steps_per_call': 1})
+    print(f"steps_per_call=1\t{base:.1f} steps/sec")
+    for k in [10, 50, Binary.default_cfg['superepoch']]:
+        rate = steps_per_sec({**cfg, 'steps_per_call': k})
+        print(f"steps_per_call={k}\t{rate:.1f} steps/sec\t"
+              f"speedup {rate / base:.2f}x")
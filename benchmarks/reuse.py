@@ -0,0 +1,80 @@
+"""Compare runs/minute of short Binary and OneHot runs over several seeds
+when every run builds a new graph and session against reusing one graph and
+reinitializing its variables.
+
+Run from the repository root with `python -m benchmarks.reuse [runs] [epochs]`.
+"""
+import sys
+import tempfile
+import time
+
+import tensorflow as tf
+
+from emergence.model.binary import Binary, BinaryHandle
+from emergence.model.one_hot import OneHot, default_config
+
+
+def binary_rebuild(cfgs, logdir):
+    for cfg in cfgs:
+        model = Binary(cfg=cfg, logdir=logdir)
+        model.run()
+        model.close()
+        tf.reset_default_graph()
+
+
+def binary_reuse(cfgs, logdir):
+    handle = BinaryHandle()
+    for cfg in cfgs:
+        handle.get(cfg, logdir).run()
+    handle.close()
+
+
+def one_hot_rebuild(cfgs, logdir):
+    for cfg in cfgs:
+        model = OneHot(cfg, logdir)
+        model.run()
+        model.sess.close()
+        tf.reset_default_graph()
+
+
+def one_hot_reuse(cfgs, logdir):
+    model = OneHot(cfgs[0], logdir)
+    for cfg in cfgs:
+        model.reset(cfg, logdir)
+        model.run()
+    model.sess.close()
+    tf.reset_default_graph()
+
+
+def runs_per_minute(fn, cfgs):
+    with tempfile.TemporaryDirectory() as logdir:
+        start = time.perf_counter()
+        fn(cfgs, logdir)
+        return 60 * len(cfgs) / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    epochs = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    # Seeds and the hyperparameters fed at run time vary between runs
+    binary_cfgs = [{
+        'epochs': epochs,
+        'seed': i,
+        'learning_rate': 1e-2 * (1 + i % 3),
+        'temp_init': 2 + i % 2,
+        'dropout_rate': 0.1 * (i % 3),
+        'summary_graph': False,
+    } for i in range(runs)]
+    one_hot_cfgs = [{
+        **default_config,
+        'epochs': epochs,
+        'temp_init': 4 + i % 2,
+    } for i in range(runs)]
+    for name, rebuild, reuse, cfgs in [
+            ('binary', binary_rebuild, binary_reuse, binary_cfgs),
+            ('one_hot', one_hot_rebuild, one_hot_reuse, one_hot_cfgs),
+            ]:
+        old = runs_per_minute(rebuild, cfgs)
+        new = runs_per_minute(reuse, cfgs)
+        print(f"{name}\trebuild {old:.1f} runs/min\treuse {new:.1f} runs/min"
+              f"\tspeedup {new / old:.2f}x")
@@ -0,0 +1,55 @@
+"""Time Binary.train_test_split against the old matrix_rank loop as
+num_concepts grows.
+
+Run from the repository root with `python -m benchmarks.split [max_concepts]`.
+"""
+import sys
+import time
+
+import numpy as np
+from numpy.linalg import matrix_rank
+
+from emergence.model.binary import Binary
+
+
+def matrix_rank_split(arr, test_split=1.0):
+    """The original splitter, which runs a full SVD for every row."""
+    indexes = list(range(len(arr)))
+    np.random.shuffle(indexes)
+    train, test = [], []
+    n = arr.shape[1]
+    covered = []
+    for i in indexes:
+        mr_covered = matrix_rank(covered)
+        if sum(arr[i]) == 0.:
+            continue
+        if mr_covered == n:
+            if len(test)/len(arr) < test_split:
+                test.append(i)
+            else:
+                train.append(i)
+        else:
+            covered.append(arr[i])
+            train.append(i)
+    return train, test
+
+
+def time_split(split, arr, test_split):
+    start = time.perf_counter()
+    train, test = split(arr, test_split)
+    elapsed = time.perf_counter() - start
+    assert matrix_rank(arr[train]) == arr.shape[1]
+    return elapsed
+
+
+if __name__ == '__main__':
+    max_concepts = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    # The old splitter is quadratic in the space size, so cap it
+    max_legacy = 12
+    print("num_concepts\tincremental (s)\tmatrix_rank (s)")
+    for n in range(4, max_concepts + 1):
+        arr = Binary.permutations(n)
+        new = time_split(Binary.train_test_split, arr, 0.1)
+        old = (f"{time_split(matrix_rank_split, arr, 0.1):.4f}"
+               if n <= max_legacy else "-")
+        print(f"{n}\t{new:.4f}\t{old}")
@@ -1,2 +1,39 @@
-from .model.binary import Binary as BinaryModel
-from .model.one_hot import OneHot as OneHotModel
+"""Models and tools for emergent communication.
+
+Attributes are imported on first access, so `import emergence` (and the
+TensorFlow-free modules such as `frozen`, `lexicon`, `metrics`, `space` and
+`util`) does not load TensorFlow until a TensorFlow model is used.
+"""
+import importlib
+
+_EXPORTS = {
+    'BinaryModel': ('.model.binary', 'Binary'),
+    'OneHotModel': ('.model.one_hot', 'OneHot'),
+    'PopulationModel': ('.model.population', 'Population'),
+    'NumpyBinaryModel': ('.model.numpy_binary', 'NumpyBinary'),
+    'ResultCache': ('.cache', 'ResultCache'),
+    'cached_run': ('.cache', 'cached_run'),
+    'EarlyStopping': ('.schedule', 'EarlyStopping'),
+    'successive_halving': ('.schedule', 'successive_halving'),
+    'AgentPair': ('.agent_pair', 'AgentPair'),
+    'save_lexicon': ('.lexicon', 'save_lexicon'),
+    'load_lexicon': ('.lexicon', 'load_lexicon'),
+    'export_lexicon': ('.lexicon', 'export_lexicon'),
+    'load_frozen': ('.frozen', 'load_frozen'),
+    'crossplay_matrix': ('.crossplay', 'crossplay'),
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module, attr = _EXPORTS[name]
+    value = getattr(importlib.import_module(module, __name__), attr)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
@@ -1,9 +1,18 @@
+import numpy as np
+
+from . import space
 
 
 class AgentPair:
 
     def __init__(self, model):
         self.model = model
+        # Argmax utterance for every input, indexed by hypercube index
+        self.encoder_table = None
+        # Decoder outputs for the utterances in decoder_keys (sorted
+        # utterance keys), or for every utterance if decoder_keys is None
+        self.decoder_table = None
+        self.decoder_keys = None
 
     def train(self, inputs, labels):
         return self.model.train(inputs, labels)
@@ -11,8 +20,79 @@ class AgentPair:
     def test(self, inputs, labels):
         return self.model.test(inputs, labels)
 
+    def build_codebook(self, max_utterances=2**20, chunk_size=2**12):
+        """Precompute the encoder's utterance for every input and the
+        decoder's output for every possible utterance, or only for the ones
+        the encoder emits if there are more than `max_utterances`."""
+        cfg = self.model.cfg
+        vocab_size, sentence_len = cfg['vocab_size'], cfg['sentence_len']
+        self.encoder_table = self.model.lexicon(chunk_size)
+        if vocab_size**sentence_len <= max_utterances:
+            keys = np.arange(vocab_size**sentence_len)
+            tokens = (keys[:, None] // vocab_size**np.arange(sentence_len)
+                    % vocab_size)
+            self.decoder_keys = None
+        else:
+            self.decoder_keys = np.unique(
+                    self.utterance_key(self.encoder_table))
+            tokens = self.decoder_keys.view(np.uint8).reshape(-1, sentence_len)
+        self.decoder_table = self.model.decode_tokens(tokens, chunk_size)
+
+    def input_index(self, inputs):
+        """Hypercube index of each binary input vector (bit i in column i)."""
+        inputs = np.asarray(inputs, dtype=np.int64)
+        return inputs @ (1 << np.arange(inputs.shape[-1], dtype=np.int64))
+
+    def utterance_index(self, tokens):
+        """Base-vocab_size index of each utterance (token i is digit i)."""
+        vocab_size = self.model.cfg['vocab_size']
+        if int(vocab_size)**np.shape(tokens)[-1] > np.iinfo(np.int64).max:
+            raise ValueError("utterances do not fit in an int64 index; use "
+                    "utterance_key")
+        tokens = np.asarray(tokens, dtype=np.int64)
+        return tokens @ (vocab_size
+                ** np.arange(tokens.shape[-1], dtype=np.int64))
+
+    def utterance_key(self, tokens):
+        """Sortable key of each utterance which, unlike its index, cannot
+        overflow: the utterance's uint8 tokens viewed as one void scalar."""
+        tokens = np.ascontiguousarray(tokens, dtype=np.uint8)
+        return tokens.view(f'V{tokens.shape[-1]}')[..., 0]
+
+    def get_utterances(self, inputs):
+        """Return the argmax utterance of each input in a (batch,
+        num_concepts) array as a (batch, sentence_len) token array."""
+        if self.encoder_table is None:
+            self.build_codebook()
+        return self.encoder_table[self.input_index(inputs)]
+
+    def parse_utterance(self, utt):
+        """Return the decoder output for each utterance in a (batch,
+        sentence_len) token array; utterances which are not in the codebook
+        are decoded with the model."""
+        if self.decoder_table is None:
+            self.build_codebook()
+        utt = np.asarray(utt)
+        if utt.ndim == 1:
+            return self.parse_utterance(utt[None])[0]
+        if self.decoder_keys is None:
+            return self.decoder_table[self.utterance_index(utt)]
+        key = self.utterance_key(utt)
+        pos = np.searchsorted(self.decoder_keys, key)
+        pos = np.minimum(pos, len(self.decoder_keys) - 1)
+        hit = self.decoder_keys[pos] == key
+        results = np.empty((len(utt), self.decoder_table.shape[-1]),
+                dtype=self.decoder_table.dtype)
+        results[hit] = self.decoder_table[pos[hit]]
+        if not hit.all():
+            results[~hit] = self.model.decode_tokens(utt[~hit])
+        return results
+
+    parse_utternace = parse_utterance
+
     def infer(self, inputs):
-        raise NotImplementedError
+        """Encode and then decode a batch of inputs through the codebook."""
+        return self.parse_utterance(self.get_utterances(inputs))
 
     def train_and_test(self):
         self.data.train, self.data.test = self.model.generate_train_and_test()
@@ -20,13 +100,13 @@ class AgentPair:
         self.test(*self.data.test)
 
     def test_all(self):
-        raise NotImplementedError
-
-    def get_utterances(self, inputs):
-        raise NotImplementedError
-
-    def parse_utternace(self, utt):
-        raise NotImplementedError
+        """Round-trip every input in the concept space through the codebook
+        and return the fraction reconstructed exactly and the fraction of
+        bits reconstructed."""
+        n = self.model.cfg['num_concepts']
+        inputs = space.index_bits(np.arange(2**n), n)
+        correct = (self.infer(inputs) > 0.5) == inputs
+        return correct.all(-1).mean(), correct.mean()
 
 '''
 a model has:
@@ -0,0 +1,179 @@
+"""On-disk cache of finished training runs.
+
+Entries are keyed by a hash of the merged config (which includes the seed)
+and of the package source, so editing the code invalidates old results. Runs
+with seed None are not reproducible and are never cached. Each entry is a
+single .npz file holding the final weights, the test losses and the emitted
+lexicon. Writes are atomic renames and eviction holds an exclusive lock, so
+several worker processes can share one cache directory.
+"""
+import fcntl
+import functools
+import hashlib
+import json
+import os
+import tempfile
+import zipfile
+
+import numpy as np
+
+DEFAULT_ROOT = os.environ.get('EMERGENCE_CACHE',
+        os.path.expanduser('~/.cache/emergence'))
+
+# Config keys which do not change what a run computes
+IGNORED_KEYS = {'intra_op_threads', 'inter_op_threads', 'verbose',
+        'checkpoint_every', 'checkpoints_to_keep', 'resume', 'summary_sink',
+        'summary_every', 'summary_graph', 'summary_flush_secs',
+        'profile_steps'}
+
+
+@functools.lru_cache(maxsize=None)
+def code_version():
+    """Hash of every Python source file in the package."""
+    root = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha256()
+    for dirpath, dirnames, filenames in sorted(os.walk(root)):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.endswith('.py'):
+                path = os.path.join(dirpath, name)
+                digest.update(os.path.relpath(path, root).encode())
+                with open(path, 'rb') as f:
+                    digest.update(f.read())
+    return digest.hexdigest()
+
+
+class ResultCache:
+
+    def __init__(self, root=DEFAULT_ROOT, max_bytes=2**30):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def key(cfg):
+        """Key for a fully merged config."""
+        cfg = {k: v for k, v in cfg.items() if k not in IGNORED_KEYS}
+        blob = json.dumps(cfg, sort_keys=True, default=str)
+        digest = hashlib.sha256(blob.encode())
+        digest.update(code_version().encode())
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.root, key + '.npz')
+
+    def get(self, key):
+        """Return the cached result for `key`, or None on a miss."""
+        path = self.path(key)
+        try:
+            with np.load(path) as data:
+                result = {
+                    'cfg': json.loads(str(data['cfg'])),
+                    'test_loss': tuple(data['test_loss']),
+                    'lexicon': data['lexicon'],
+                    'weights': {k[len('weights/'):]: data[k]
+                        for k in data.files if k.startswith('weights/')},
+                }
+            # Mark as recently used for eviction
+            os.utime(path)
+        except (FileNotFoundError, zipfile.BadZipFile, KeyError):
+            # Missing, evicted mid-read or partially written by an older
+            # version; treat all of these as misses
+            return None
+        return result
+
+    def put(self, key, result):
+        arrays = {
+            'cfg': np.array(json.dumps(result['cfg'], sort_keys=True,
+                default=str)),
+            'test_loss': np.array(result['test_loss']),
+            'lexicon': result['lexicon'],
+        }
+        for name, value in result['weights'].items():
+            arrays['weights/' + name] = value
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(tmp, self.path(key))
+        except BaseException:
+            os.remove(tmp)
+            raise
+        self.evict()
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits in
+        max_bytes."""
+        with open(os.path.join(self.root, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            entries = []
+            for name in os.listdir(self.root):
+                if not name.endswith('.npz'):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(self.root, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.root, name))
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+
+def cached_run(cfg=None, cache=None, logdir='log', verbose=False,
+        handle=None):
+    """Train a BinaryModel on `cfg`, or load the result of an identical
+    earlier run. Returns a dict with the merged cfg, the (average, max) test
+    loss, the argmax lexicon over the whole input space (empty for sampled
+    data, whose space is too large to enumerate) and the final weights.
+    Runs with seed None always train and are not cached. With a
+    `BinaryHandle`, the model comes from (and is left open in) the handle,
+    so runs sharing a graph skip rebuilding it."""
+    from .defaults import BINARY_CFG, NUMPY_BINARY_CFG
+
+    cfg = cfg or {}
+    if cfg.get('backend') == 'numpy':
+        cfg = {**NUMPY_BINARY_CFG, **cfg}
+    else:
+        cfg = {**BINARY_CFG, **cfg}
+    if cache is None:
+        cache = ResultCache()
+    key = ResultCache.key(cfg)
+    seeded = cfg['seed'] is not None
+    result = cache.get(key) if seeded else None
+    if result is not None:
+        if verbose:
+            print(f"loaded cached run {key[:12]}")
+        return result
+
+    if handle is not None:
+        model = handle.get(cfg, logdir)
+    # Only the TensorFlow backend needs TensorFlow imported
+    elif cfg['backend'] == 'numpy':
+        from .model.numpy_binary import NumpyBinary
+        model = NumpyBinary(cfg=cfg, logdir=logdir)
+    else:
+        import tensorflow as tf
+        from .model.binary import Binary
+        model = Binary(cfg=cfg, logdir=logdir)
+    model.run(verbose=verbose)
+    result = {
+        'cfg': cfg,
+        'test_loss': model.test(verbose=verbose),
+        'lexicon': (np.zeros((0, cfg['sentence_len']), dtype=np.uint8)
+            if cfg['data_mode'] == 'sampled' else model.lexicon()),
+        'weights': model.get_weights(),
+    }
+    if handle is None or cfg['backend'] == 'numpy':
+        model.close()
+    if handle is None and cfg['backend'] == 'tf':
+        tf.reset_default_graph()
+    if seeded:
+        cache.put(key, result)
+    return result
@@ -0,0 +1,133 @@
+"""Cross-play evaluation: every encoder of N frozen Binary pairs against every
+decoder of M pairs on a shared input space.
+
+The weights of all pairs are stacked, so each chunk of inputs is encoded by
+all N encoders and decoded by all M decoders in a few batched einsums. Pairs
+must share num_concepts, sentence_len and vocab_size and, to be stacked, the
+layer sizes (as runs differing only in their seed do).
+
+    python -m emergence.crossplay out.npz run0.npz run1.npz ...
+        [--decoders runA.npz ...]
+"""
+import argparse
+import json
+
+import numpy as np
+
+from . import space
+from .frozen import load_frozen, relu
+
+
+def stack(pairs):
+    """Each weight of the pairs stacked along a new leading axis."""
+    first = pairs[0]
+    for pair in pairs[1:]:
+        shapes = {k: v.shape for k, v in pair.w.items()}
+        if (pair.num_concepts, pair.sentence_len, pair.vocab_size) != (
+                first.num_concepts, first.sentence_len, first.vocab_size):
+            raise ValueError("pairs differ in num_concepts, sentence_len or "
+                    "vocab_size")
+        if shapes != {k: v.shape for k, v in first.w.items()}:
+            raise ValueError("pairs differ in layer sizes")
+    return {k: np.stack([p.w[k] for p in pairs]) for k in first.w}
+
+
+def encode_all(enc, inputs, sentence_len, vocab_size):
+    """Argmax tokens (N, batch, sentence_len) of N stacked encoders."""
+    emb = np.einsum('xc,nci->nxi', inputs, enc['embeddings'])
+    h = relu(np.einsum('nxi,nih->nxh', emb, enc['encoder_h0_w'])
+            + enc['encoder_h0_b'][:, None])
+    logits = (np.einsum('nxh,nhk->nxk', h, enc['encoder_word_w'])
+            + enc['encoder_word_b'][:, None])
+    return logits.reshape(logits.shape[:2] + (sentence_len, vocab_size)
+            ).argmax(-1)
+
+
+def decode_all(dec, tokens):
+    """Logits (M, N, batch, num_concepts) of M stacked decoders on the
+    tokens (N, batch, sentence_len) of N encoders."""
+    m = len(dec['d_fc_w'])
+    # A one-hot word times d_fc_w is a row of d_fc_w
+    d = dec['d_fc_w'][np.arange(m)[:, None, None, None], tokens[None]]
+    d = relu(d + dec['d_fc_b'][:, None, None])
+    d = d.reshape(d.shape[:3] + (-1,))
+    d = d * dec['bn_scale'][:, None, None] + dec['bn_shift'][:, None, None]
+    o = (np.einsum('mnxf,mfo->mnxo', d, dec['decoder_output_w'])
+            + dec['decoder_output_b'][:, None, None])
+    return (np.einsum('mnxo,moc->mnxc', o, dec['decoder_class_w'])
+            + dec['decoder_class_b'][:, None, None])
+
+
+def crossplay(encoders, decoders=None, inputs=None, max_elements=2**24):
+    """Mean loss (sigmoid cross-entropy, as in training) and accuracy
+    (fraction of inputs reconstructed exactly) of every encoder against
+    every decoder, as (N, M) arrays indexed [encoder, decoder]. Decoders
+    default to the encoders' own pairs; inputs to the whole space."""
+    if decoders is None:
+        decoders = encoders
+    enc, dec = stack(encoders), stack(decoders)
+    first = encoders[0]
+    if inputs is None:
+        inputs = space.permutations(first.num_concepts)
+    inputs = np.asarray(inputs, dtype=np.float32)
+    n, m = len(encoders), len(decoders)
+    # The largest intermediate is the decoder's (M, N, chunk, L, D) input
+    width = dec['d_fc_b'][0].size
+    chunk = max(1, max_elements // (n * m * width))
+    loss = np.zeros((n, m))
+    correct = np.zeros((n, m))
+    for start in range(0, len(inputs), chunk):
+        x = inputs[start:start + chunk]
+        tokens = encode_all(enc, x, first.sentence_len, first.vocab_size)
+        logits = decode_all(dec, tokens)
+        ce = (np.maximum(logits, 0) - logits * x
+                + np.log1p(np.exp(-np.abs(logits))))
+        loss += ce.mean(-1).sum(-1).T
+        correct += ((logits > 0) == (x > 0)).all(-1).sum(-1).T
+    return loss / len(inputs), correct / len(inputs)
+
+
+def summarize(loss, accuracy, same_pairs):
+    """Summary statistics of a cross-play matrix; with `same_pairs` (the
+    encoders and decoders come from the same runs, in order) the diagonal
+    is reported as self-play and the rest as cross-play."""
+    summary = {}
+    for name, matrix in [('loss', loss), ('accuracy', accuracy)]:
+        summary[f'{name}_mean'] = float(matrix.mean())
+        summary[f'{name}_std'] = float(matrix.std())
+        summary[f'{name}_min'] = float(matrix.min())
+        summary[f'{name}_max'] = float(matrix.max())
+        if same_pairs:
+            off = ~np.eye(len(matrix), dtype=bool)
+            summary[f'self_{name}'] = float(np.diag(matrix).mean())
+            summary[f'cross_{name}'] = (float(matrix[off].mean())
+                    if off.any() else float('nan'))
+    return summary
+
+
+def save_crossplay(path, loss, accuracy, summary, encoders, decoders):
+    """Write the matrices, the run names and the summary (as JSON) to an
+    .npz file."""
+    np.savez(path, loss=loss, accuracy=accuracy,
+            encoders=np.array(encoders), decoders=np.array(decoders),
+            summary=json.dumps(summary))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('out')
+    parser.add_argument('encoders', nargs='+',
+            help="frozen pairs (see Binary.freeze)")
+    parser.add_argument('--decoders', nargs='+',
+            help="frozen pairs whose decoders to use; default: the encoders'")
+    args = parser.parse_args()
+
+    decoder_paths = args.decoders or args.encoders
+    loss, accuracy = crossplay(
+            [load_frozen(p) for p in args.encoders],
+            [load_frozen(p) for p in decoder_paths])
+    summary = summarize(loss, accuracy, decoder_paths == args.encoders)
+    save_crossplay(args.out, loss, accuracy, summary, args.encoders,
+            decoder_paths)
+    print(json.dumps(summary, indent=2))
@@ -0,0 +1,141 @@
+"""Sampled training data for concept spaces too large to enumerate.
+
+Whether a binary vector belongs to the test set is a deterministic function
+of a hash of its bits, so the test set never has to be stored and training
+batches can be drawn independently while still excluding it. The unit
+vectors are always in the training set and in every training batch, which
+keeps the guarantee of `space.train_test_split` that the training data spans
+the whole space.
+"""
+import queue
+import threading
+
+import numpy as np
+
+from . import space
+
+# Largest space which is filtered by enumeration rather than by sampling
+MAX_ENUMERATED = 2**20
+
+
+def splitmix64(x):
+    x = x + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def vector_hash(bits):
+    """64-bit hash of each row of a (batch, num_concepts) binary array."""
+    packed = np.packbits(np.asarray(bits, dtype=np.uint8), axis=-1,
+            bitorder='little')
+    packed = np.pad(packed, [(0, 0), (0, -packed.shape[-1] % 8)])
+    words = packed.view('<u8')
+    h = np.zeros(len(words), dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for w in range(words.shape[1]):
+            h = splitmix64(h ^ words[:, w])
+    return h
+
+
+def is_test(bits, test_prop):
+    """Whether each row is in the held-out test set. The zero vector is in
+    neither set and unit vectors are always training data."""
+    bits = np.asarray(bits)
+    weight = bits.sum(-1)
+    uniform = (vector_hash(bits) >> np.uint64(11)) / 2.**53
+    return (uniform < test_prop) & (weight > 1)
+
+
+def check_test_prop(test_prop):
+    # Training batches are drawn by rejection, so the train set needs a
+    # share of the space
+    if not 0 <= test_prop < 1:
+        raise ValueError(f"sampled data needs 0 <= test_prop < 1, got "
+                f"{test_prop}")
+
+
+def unit_vectors(n):
+    return np.identity(n, dtype=np.uint8)
+
+
+def sample_train_batches(n, batch_size, test_prop, seed=None):
+    """Yield endless batches of `batch_size` random training vectors
+    followed by the `n` unit vectors."""
+    check_test_prop(test_prop)
+    rng = np.random.RandomState(seed)
+    while True:
+        rows = []
+        needed = batch_size
+        while needed > 0:
+            bits = rng.randint(0, 2, size=(2 * needed, n), dtype=np.uint8)
+            bits = bits[bits.any(-1) & ~is_test(bits, test_prop)][:needed]
+            rows.append(bits)
+            needed -= len(bits)
+        yield np.concatenate(rows + [unit_vectors(n)])
+
+
+def test_sample(n, size, test_prop, seed=0):
+    """A deterministic sample of at most `size` test vectors; for small
+    spaces, the whole test set if it is smaller than that. Empty if
+    `test_prop` is 0."""
+    check_test_prop(test_prop)
+    if test_prop == 0:
+        return np.zeros((0, n), dtype=np.uint8)
+    rng = np.random.RandomState(seed)
+    if 2**n <= MAX_ENUMERATED:
+        bits = space.index_bits(np.arange(2**n), n)
+        bits = bits[is_test(bits, test_prop)]
+        rng.shuffle(bits)
+        return bits[:size]
+    rows = []
+    needed = size
+    while needed > 0:
+        bits = rng.randint(0, 2, size=(max(4 * needed, 1024), n),
+                dtype=np.uint8)
+        bits = bits[is_test(bits, test_prop)][:needed]
+        rows.append(bits)
+        needed -= len(bits)
+    return np.concatenate(rows)
+
+
+class Prefetcher:
+    """Iterates over `generator` run in a background thread, keeping up to
+    `depth` items ready, until closed."""
+
+    def __init__(self, generator, depth=4, poll_secs=0.1):
+        self.items = queue.Queue(maxsize=depth)
+        self.poll_secs = poll_secs
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.fill, args=(generator,),
+                daemon=True)
+        self.thread.start()
+
+    def fill(self, generator):
+        for item in generator:
+            # Wait for room in the queue, but not past close()
+            while not self.stopped.is_set():
+                try:
+                    self.items.put(item, timeout=self.poll_secs)
+                    break
+                except queue.Full:
+                    pass
+            if self.stopped.is_set():
+                return
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.items.get()
+
+    def close(self):
+        """Stop the thread and wait for it to finish."""
+        self.stopped.set()
+        self.thread.join()
+
+
+def prefetch(generator, depth=4):
+    """Run `generator` in a background thread, keeping up to `depth` items
+    ready; see `Prefetcher`."""
+    return Prefetcher(generator, depth)
@@ -0,0 +1,82 @@
+"""Default configurations, importable without TensorFlow."""
+
+BINARY_CFG = {
+    # Actual batch_size == batch_size * num_concepts
+    'batch_size': 7,
+    'epochs': 5000,
+     # How often to anneal temperature
+     # More like a traditional epoch due to small dataset size
+    'superepoch': 200,
+    'e_dense_size': 14,
+    'd_dense_size': 2,
+    'input_dim': 8,
+    'num_concepts': 7,
+    'sentence_len': 7,
+    'vocab_size': 2,
+
+    'learning_rate': 1e-2,
+    'temp_init': 3,
+    'temp_decay': 0.85,
+    'train_st': False,
+    'test_prop': 0.1,
+    'dropout_rate': 0.2,
+    # Seed for the train/test split; None uses the global numpy state
+    'seed': None,
+    # Optimizer steps per session call; above 1 the training loop runs
+    # on-device in a tf.while_loop
+    'steps_per_call': 1,
+    # Train on each example once with a loss weight of batch_size rather
+    # than repeating it batch_size times; the gradient is the same in
+    # expectation but the feed and per-step cost no longer scale with it
+    'weighted_examples': False,
+    # 'tf', or 'numpy' for the pure-NumPy engine in numpy_binary
+    'backend': 'tf',
+    # Session thread pool sizes; 0 lets TensorFlow pick
+    'intra_op_threads': 0,
+    'inter_op_threads': 0,
+    # Stop at a superepoch boundary once the argmax channel reconstructs
+    # every training input with loss below converged_loss, or once its
+    # loss has not improved by min_delta for patience superepochs
+    'early_stopping': False,
+    'converged_loss': 1e-2,
+    'patience': 5,
+    'min_delta': 1e-3,
+    # Per-position decoder layer: 'einsum', or 'tile' for the original
+    # implementation which tiles the weights across the batch
+    'decoder': 'einsum',
+    # 'enumerate' splits the whole 2**num_concepts space; 'sampled' draws
+    # fresh random training vectors every step and holds out the ones
+    # whose hash falls in the test set (see emergence.data)
+    'data_mode': 'enumerate',
+    'samples_per_step': 256,
+    'num_test_samples': 4096,
+    # Epochs to trace with RunMetadata, written under logdir/profile
+    'profile_steps': [],
+    # Save a checkpoint to logdir/checkpoints every this many superepochs
+    # and at the end of the run; 0 disables checkpointing
+    'checkpoint_every': 0,
+    'checkpoints_to_keep': 3,
+    # Continue from the latest checkpoint in logdir, if there is one
+    'resume': False,
+    # Checkpoint (or checkpoint directory) of a trained pair to initialize
+    # the model variables from; variables whose shape changed, e.g. with a
+    # larger sentence_len or num_concepts, get the overlapping block
+    'warm_start': None,
+    # Where the train and test loss and accuracy go: 'tensorboard', 'csv'
+    # (logdir/metrics.csv), 'npz' (logdir/metrics.npz) or None
+    'summary_sink': 'tensorboard',
+    # Record them every this many superepochs
+    'summary_every': 1,
+    # Write the graph to the TensorBoard train log
+    'summary_graph': True,
+    # Seconds between background flushes of buffered summaries
+    'summary_flush_secs': 10,
+}
+
+# The NumPy engine's defaults: TensorBoard event files need TensorFlow, so
+# its summaries go to logdir/metrics.npz
+NUMPY_BINARY_CFG = {
+    **BINARY_CFG,
+    'backend': 'numpy',
+    'summary_sink': 'npz',
+}
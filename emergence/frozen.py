@@ -0,0 +1,148 @@
+"""Trained agent pairs frozen to NumPy weights for inference without
+TensorFlow.
+
+A frozen pair keeps only the argmax encoder path and the decoder: no
+optimizer state, sampler, dropout or summaries. Batch normalization, which
+the models only run in inference mode, is folded into a scale and shift.
+Models write them with their `freeze(path)` method and `load_frozen` reads
+them back as a `FrozenBinary` or `FrozenOneHot`, whose `encode` and `decode`
+work through large batches in chunks.
+"""
+import json
+
+import numpy as np
+
+VERSION = 1
+
+
+def fold_batch_norm(gamma, beta, mean, variance, epsilon):
+    """Scale and shift equivalent to batch normalization in inference
+    mode."""
+    scale = gamma / np.sqrt(variance + epsilon)
+    return scale, beta - mean * scale
+
+
+def relu(x):
+    return np.maximum(x, 0)
+
+
+def softmax(x):
+    e = np.exp(x - x.max(axis=-1, keepdims=True))
+    return e / e.sum(axis=-1, keepdims=True)
+
+
+def sigmoid(x):
+    return 1 / (1 + np.exp(-x))
+
+
+class Frozen:
+    """Base class; `w` maps weight names to float32 arrays."""
+
+    kind = None
+    weight_names = []
+
+    def __init__(self, weights, num_concepts, sentence_len, vocab_size):
+        self.w = {k: np.asarray(weights[k], dtype=np.float32)
+                for k in self.weight_names}
+        self.num_concepts = num_concepts
+        self.sentence_len = sentence_len
+        self.vocab_size = vocab_size
+
+    def encode(self, inputs, chunk_size=2**14):
+        """Argmax utterances (batch, sentence_len) uint8 for a batch of
+        inputs (batch, num_concepts)."""
+        inputs = np.asarray(inputs, dtype=np.float32)
+        return np.concatenate([
+            self.encoder_logits(inputs[i:i + chunk_size]).argmax(-1)
+            for i in range(0, len(inputs), chunk_size)
+            ] or [np.zeros((0, self.sentence_len))]).astype(np.uint8)
+
+    def decode(self, tokens, chunk_size=2**14):
+        """Decoder output (batch, num_concepts) for a batch of utterances
+        (batch, sentence_len)."""
+        tokens = np.asarray(tokens, dtype=np.int64)
+        return np.concatenate([
+            self.decoder_output(tokens[i:i + chunk_size])
+            for i in range(0, len(tokens), chunk_size)
+            ] or [np.zeros((0, self.num_concepts), dtype=np.float32)])
+
+    def save(self, path):
+        np.savez(path, **self.w, header=json.dumps({
+            'version': VERSION,
+            'kind': self.kind,
+            'num_concepts': self.num_concepts,
+            'sentence_len': self.sentence_len,
+            'vocab_size': self.vocab_size,
+            }))
+
+
+class FrozenBinary(Frozen):
+    """The Binary architecture; `decode` returns per-concept sigmoid
+    probabilities."""
+
+    kind = 'binary'
+    weight_names = ['embeddings', 'encoder_h0_w', 'encoder_h0_b',
+            'encoder_word_w', 'encoder_word_b', 'd_fc_w', 'd_fc_b',
+            'bn_scale', 'bn_shift', 'decoder_output_w', 'decoder_output_b',
+            'decoder_class_w', 'decoder_class_b']
+
+    def encoder_logits(self, inputs):
+        w = self.w
+        h = relu(inputs @ w['embeddings'] @ w['encoder_h0_w']
+                + w['encoder_h0_b'])
+        logits = h @ w['encoder_word_w'] + w['encoder_word_b']
+        return logits.reshape(len(inputs), self.sentence_len, self.vocab_size)
+
+    def decoder_output(self, tokens):
+        w = self.w
+        # A one-hot word times d_fc_w is a row of d_fc_w
+        d = relu(w['d_fc_w'][tokens] + w['d_fc_b']).reshape(len(tokens), -1)
+        o = (d * w['bn_scale'] + w['bn_shift']) @ w['decoder_output_w']
+        o = o + w['decoder_output_b']
+        return sigmoid(o @ w['decoder_class_w'] + w['decoder_class_b'])
+
+
+class FrozenOneHot(Frozen):
+    """The OneHot architecture; inputs are one-hot concepts and `decode`
+    returns a softmax over the concepts."""
+
+    kind = 'one_hot'
+    weight_names = ['concept_space_w', 'encoder_h0_w', 'encoder_h0_b',
+            'encoder_bn_scale', 'encoder_bn_shift', 'encoder_word_w',
+            'encoder_word_b', 'decoder_input_w', 'decoder_input_b',
+            'decoder_bn_scale', 'decoder_bn_shift', 'decoder_output_w',
+            'decoder_output_b', 'decoder_class_w', 'decoder_class_b']
+
+    def encoder_logits(self, inputs):
+        w = self.w
+        h = relu(inputs @ w['concept_space_w'] @ w['encoder_h0_w']
+                + w['encoder_h0_b'])
+        h = h * w['encoder_bn_scale'] + w['encoder_bn_shift']
+        logits = h @ w['encoder_word_w'] + w['encoder_word_b']
+        return logits.reshape(len(inputs), self.sentence_len, self.vocab_size)
+
+    def decoder_output(self, tokens):
+        w = self.w
+        # Flattened one-hot words times the kernel, as a gather and sum
+        kernel = w['decoder_input_w'].reshape(self.sentence_len,
+                self.vocab_size, -1)
+        d = kernel[np.arange(self.sentence_len), tokens].sum(1)
+        d = relu(d + w['decoder_input_b'])
+        d = d * w['decoder_bn_scale'] + w['decoder_bn_shift']
+        o = d @ w['decoder_output_w'] + w['decoder_output_b']
+        return softmax(o @ w['decoder_class_w'] + w['decoder_class_b'])
+
+
+KINDS = {cls.kind: cls for cls in [FrozenBinary, FrozenOneHot]}
+
+
+def load_frozen(path):
+    with np.load(path) as data:
+        header = json.loads(str(data['header']))
+        if header['version'] != VERSION:
+            raise ValueError(
+                    f"unsupported frozen model version {header['version']}")
+        cls = KINDS[header['kind']]
+        return cls({k: data[k] for k in cls.weight_names},
+                header['num_concepts'], header['sentence_len'],
+                header['vocab_size'])
@@ -1,58 +1,147 @@
+"""Parallel hyperparameter search over BinaryModel.
+
+Trials are evaluated in a process pool, one TF session per worker, and
+proposed with hyperopt's ask/tell interface so that every worker always has a
+trial in flight. Run with `python -m emergence.hp_tune --workers 8`.
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
 import numpy as np
-from binary_compositional import AgentPair 
-from hyperopt import hp, tpe, fmin, Trials
-import tensorflow as tf
+from hyperopt import hp, tpe, Trials, STATUS_OK, JOB_STATE_RUNNING, \
+        JOB_STATE_DONE, space_eval
+from hyperopt.base import Domain
+
+from .launcher import core_sets, get_handle, init_worker
 
 ITERS = 1
 
-count = 0
+space = {
+    # Actual batch_size == batch_size * num_concepts
+    #'batch_size': hp.qlognormal('batch_size', 2.0, 0.3, 1),#4,
+    #'epochs': hp.qlognormal('epochs', 8.3, 0.3, 100),#4000,
+     # How often to anneal temperature
+     # More like a traditional epoch due to small dataset size
+    #'superepoch': hp.qlognormal('superepoch', 5.3, 0.2, 10),#200,
+    'e_dense_size': hp.qlognormal('e_dense_size', 2.5, 0.4, 1),#20,
+    'd_dense_size': hp.qlognormal('d_dense_size', 3., 0.5, 1),#20,
+    #'input_dim': 8,
+    #'num_concepts': 7,
+    #'sentence_len': 7,
+    #'vocab_size': 2,
+
+    'temp_init': hp.lognormal('temp_init', 1.2, 0.4),#4,
+    'temp_decay': hp.uniform('temp_decay', 0.8, 1),#0.9,
+    #'train_st': hp.choice('train_st', [
+    #    ('st_false', 0),
+    #    ('st_true', 1),
+    #]),
+    #'test_prop': 0.1,
+    'dropout_rate': hp.uniform('dropout_rate', 0, 0.4),#0.3,
+}
+
+
 def do_run(cfg):
-    scores = []
-    #for k in ['batch_size', 'epochs', 'superepoch', 'e_dense_size',
-    #        'd_dense_size']:
+    """Average test loss of `cfg` over ITERS runs. Executed in a worker
+    process, so TensorFlow is only imported there. Every run in a worker
+    goes through the worker's one BinaryHandle, so runs and trials with the
+    same graph keys reuse its graph and session."""
+    from .cache import cached_run
+
     for k in ['e_dense_size', 'd_dense_size']:
         cfg[k] = int(cfg[k])
-    #cfg['train_st'] = cfg['train_st'][1]
-    for _ in range(ITERS):
-        ap = AgentPair(cfg)
-        scores.append(ap.get_performance())
-        tf.reset_default_graph()
-    loss = np.average([s['average'] for s in scores])
-    global count
-    count += 1
-    print(count)
-    print(cfg)
-    print(loss)
-    print()
-    return loss
+    scores = []
+    # Seeded so that repeated trials are served from the result cache
+    for i in range(ITERS):
+        with tempfile.TemporaryDirectory() as logdir:
+            result = cached_run({**cfg, 'seed': i}, logdir=logdir,
+                    handle=get_handle())
+        scores.append(result['test_loss'][0])
+    return float(np.average(scores))
 
-if __name__ == '__main__':
-    space = {
-        # Actual batch_size == batch_size * num_concepts
-        #'batch_size': hp.qlognormal('batch_size', 2.0, 0.3, 1),#4,
-        #'epochs': hp.qlognormal('epochs', 8.3, 0.3, 100),#4000,
-         # How often to anneal temperature
-         # More like a traditional epoch due to small dataset size
-        #'superepoch': hp.qlognormal('superepoch', 5.3, 0.2, 10),#200,
-        'e_dense_size': hp.qlognormal('e_dense_size', 2.5, 0.4, 1),#20,
-        'd_dense_size': hp.qlognormal('d_dense_size', 3., 0.5, 1),#20,
-        #'input_dim': 8,
-        #'num_concepts': 7,
-        #'sentence_len': 7,
-        #'vocab_size': 2,
-
-        'temp_init': hp.lognormal('temp_init', 1.2, 0.4),#4,
-        'temp_decay': hp.uniform('temp_decay', 0.8, 1),#0.9,
-        #'train_st': hp.choice('train_st', [
-        #    ('st_false', 0),
-        #    ('st_true', 1),
-        #]),
-        #'test_prop': 0.1,
-        'dropout_rate': hp.uniform('dropout_rate', 0, 0.4),#0.3,
-        
-        #'verbose': True,
-    }
+
+def suggest(domain, trials, rng):
+    """Ask TPE for one new trial and mark it as running."""
+    tid, = trials.new_trial_ids(1)
+    trials.refresh()
+    docs = tpe.suggest([tid], domain, trials, rng.randint(2**31 - 1))
+    for doc in docs:
+        doc['state'] = JOB_STATE_RUNNING
+    trials.insert_trial_docs(docs)
+    trials.refresh()
+    doc, = [t for t in trials.trials if t['tid'] == tid]
+    vals = {k: v[0] for k, v in doc['misc']['vals'].items() if v}
+    return doc, space_eval(domain.expr, vals)
+
+
+def search(max_evals=50, workers=None, base_cfg=None, seed=None):
+    """Run `max_evals` trials with `workers` in flight at a time and return
+    the hyperopt Trials object."""
+    if workers is None:
+        workers = len(os.sched_getaffinity(0))
+    base_cfg = base_cfg or {}
+    rng = np.random.RandomState(seed)
+    domain = Domain(do_run, space)
     trials = Trials()
-    best = fmin(do_run, space=space, max_evals=50, algo=tpe.suggest,
-            trials=trials)
-    import pdb; pdb.set_trace()
+    # TensorFlow is not fork-safe, so start workers fresh
+    context = multiprocessing.get_context('spawn')
+    # Each worker is pinned to its own cores
+    core_queue = context.Queue()
+    for worker_set in core_sets(workers):
+        core_queue.put(worker_set)
+    start = time.time()
+    done = 0
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+            initializer=init_worker, initargs=(core_queue,)) as pool:
+        running = {}
+        submitted = 0
+        while done < max_evals:
+            while len(running) < workers and submitted < max_evals:
+                doc, params = suggest(domain, trials, rng)
+                future = pool.submit(do_run, {**base_cfg, **params})
+                running[future] = (doc, params)
+                submitted += 1
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                doc, params = running.pop(future)
+                loss = future.result()
+                doc['result'] = {'loss': loss, 'status': STATUS_OK}
+                doc['state'] = JOB_STATE_DONE
+                done += 1
+                hours = (time.time() - start) / 3600
+                print(f"trial {doc['tid']}\tloss: {loss:.3f}\t{params}")
+                print(f"{done}/{max_evals} done\t"
+                      f"{done / hours:.1f} trials/hour")
+            trials.refresh()
+    return trials
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--max-evals', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=None,
+            help="concurrent trials (default: one per core)")
+    parser.add_argument('--intra-op-threads', type=int, default=1,
+            help="TF intra-op threads per worker")
+    parser.add_argument('--inter-op-threads', type=int, default=1,
+            help="TF inter-op threads per worker")
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    trials = search(
+            max_evals=args.max_evals,
+            workers=args.workers,
+            base_cfg={
+                'intra_op_threads': args.intra_op_threads,
+                'inter_op_threads': args.inter_op_threads,
+            },
+            seed=args.seed,
+            )
+    best = trials.best_trial
+    vals = {k: v[0] for k, v in best['misc']['vals'].items() if v}
+    print(f"best loss: {best['result']['loss']:.3f}")
+    print(space_eval(space, vals))
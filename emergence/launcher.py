@@ -0,0 +1,169 @@
+"""Pack many small Binary runs onto one machine.
+
+Each worker process is pinned to its own set of cores and its sessions get
+as many intra-op threads as it has cores (and `inter_op_threads` inter-op
+threads), so co-located runs do not oversubscribe the machine. Unless the
+number of workers is given, a short calibration trains the first config with
+1, 2, 4, ... workers at once and keeps the count with the highest aggregate
+steps/sec.
+
+Run with e.g. `python -m emergence.launcher --runs 64 --cfg '{"epochs": 2000}'`.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Set in each worker by `init_worker`
+worker_cores = None
+# The BinaryHandle of this process, see `get_model`
+worker_handle = None
+
+
+def available_cores():
+    return sorted(os.sched_getaffinity(0))
+
+
+def core_sets(workers, cores=None):
+    """Split `cores` into `workers` contiguous sets, or give each worker one
+    core round-robin if there are more workers than cores."""
+    cores = available_cores() if cores is None else list(cores)
+    if workers <= len(cores):
+        return [[int(c) for c in chunk]
+                for chunk in np.array_split(cores, workers)]
+    return [[cores[i % len(cores)]] for i in range(workers)]
+
+
+def init_worker(core_queue):
+    """Pool initializer: pin this process to the next free core set."""
+    global worker_cores
+    worker_cores = core_queue.get()
+    os.sched_setaffinity(0, worker_cores)
+
+
+def get_handle():
+    """The BinaryHandle of this process, created on first use."""
+    global worker_handle
+    if worker_handle is None:
+        from .model.binary import BinaryHandle
+        worker_handle = BinaryHandle()
+    return worker_handle
+
+
+def get_model(cfg, logdir):
+    """A Binary model for `cfg`, reusing this process's graph when the graph
+    keys match; the numpy backend does not import TensorFlow."""
+    if cfg.get('backend') == 'numpy':
+        from .model.numpy_binary import NumpyBinary
+        return NumpyBinary(cfg, logdir)
+    return get_handle().get(cfg, logdir)
+
+
+def train(cfg, inter_op_threads=1):
+    """Train one run in a pinned worker and return its steps and seconds.
+    Runs in the same worker which share a graph reuse it."""
+    cfg = {
+        'intra_op_threads': len(worker_cores),
+        'inter_op_threads': inter_op_threads,
+        'summary_sink': None,
+        **cfg,
+    }
+    with tempfile.TemporaryDirectory() as logdir:
+        start = time.perf_counter()
+        model = get_model(cfg, logdir)
+        model.run()
+        seconds = time.perf_counter() - start
+        test_loss = model.test()
+    return {
+        'cfg': cfg,
+        'steps': model.epochs_run,
+        'seconds': seconds,
+        'test_loss': float(test_loss[0]),
+    }
+
+
+def run_pool(cfgs, workers, cores=None, inter_op_threads=1):
+    """Train `cfgs` with `workers` pinned processes; return the results and
+    the aggregate steps/sec."""
+    context = multiprocessing.get_context('spawn')
+    core_queue = context.Queue()
+    for worker_set in core_sets(workers, cores):
+        core_queue.put(worker_set)
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+            initializer=init_worker, initargs=(core_queue,)) as pool:
+        results = list(pool.map(train, cfgs,
+            [inter_op_threads] * len(cfgs)))
+    elapsed = time.perf_counter() - start
+    return results, sum(r['steps'] for r in results) / elapsed
+
+
+def calibrate(cfg, epochs=300, cores=None, inter_op_threads=1,
+        verbose=False):
+    """Return the worker count with the highest aggregate steps/sec when
+    each worker trains `cfg` for `epochs` epochs, trying powers of two up to
+    the number of cores."""
+    num_cores = len(available_cores() if cores is None else cores)
+    candidates = [2**i for i in range(num_cores.bit_length())]
+    if candidates[-1] != num_cores:
+        candidates.append(num_cores)
+    cfg = {**cfg, 'epochs': epochs}
+    rates = {}
+    for workers in candidates:
+        # Each worker builds its graph in its first run, so give it two
+        _, rates[workers] = run_pool([cfg] * (2 * workers), workers, cores,
+                inter_op_threads)
+        if verbose:
+            print(f"{workers} workers\t{rates[workers]:.1f} steps/sec")
+    return max(rates, key=rates.get)
+
+
+def launch(cfgs, workers=None, cores=None, inter_op_threads=1,
+        calibration_epochs=300, verbose=False):
+    """Train every config in `cfgs` on this node and return the results
+    with a per-node report."""
+    if workers is None:
+        workers = calibrate(cfgs[0], calibration_epochs, cores,
+                inter_op_threads, verbose)
+    results, rate = run_pool(cfgs, workers, cores, inter_op_threads)
+    report = {
+        'node': socket.gethostname(),
+        'workers': workers,
+        'runs': len(results),
+        'steps_per_sec': rate,
+    }
+    if verbose:
+        print(f"{report['node']}\t{workers} workers\t{len(results)} runs\t"
+              f"{rate:.1f} steps/sec")
+    return results, report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=16,
+            help="runs of the config, with seeds 0, 1, ...")
+    parser.add_argument('--cfg', type=json.loads, default={},
+            help="BinaryModel config as JSON")
+    parser.add_argument('--workers', type=int, default=None,
+            help="concurrent runs (default: calibrate)")
+    parser.add_argument('--inter-op-threads', type=int, default=1)
+    parser.add_argument('--calibration-epochs', type=int, default=300)
+    parser.add_argument('--out', default=None,
+            help="write the results and report here as JSON")
+    args = parser.parse_args()
+
+    cfgs = [{**args.cfg, 'seed': i} for i in range(args.runs)]
+    results, report = launch(cfgs, args.workers,
+            inter_op_threads=args.inter_op_threads,
+            calibration_epochs=args.calibration_epochs, verbose=True)
+    if args.out is not None:
+        with open(args.out, 'w') as f:
+            json.dump({'report': report, 'results': results}, f, indent=2,
+                    default=str)
@@ -0,0 +1,122 @@
+"""Compact binary export of a trained language.
+
+A lexicon file holds a fixed-size header followed by three sections, each
+starting on an 8-byte boundary:
+
+    inputs   (num_rows, ceil(num_concepts / 8)) uint8, bit-packed, bit i of
+             an input in bit i % 8 of byte i // 8
+    tokens   (num_rows, sentence_len) uint8, the argmax utterance
+    outputs  (num_rows, num_concepts) float16, the decoder's sigmoid output
+             for that utterance (only if the header's has_outputs is set)
+
+`load_lexicon` memory-maps the sections so that many saved runs can be
+analysed without reading them into memory.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+from . import space
+
+MAGIC = b'EMLX'
+VERSION = 1
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S4'),
+    ('version', '<u2'),
+    ('num_concepts', '<u2'),
+    ('sentence_len', '<u2'),
+    ('vocab_size', '<u2'),
+    ('has_outputs', '<u2'),
+    ('reserved', '<u2'),
+    ('num_rows', '<u8'),
+])
+
+Lexicon = namedtuple('Lexicon', [
+    'num_concepts', 'vocab_size', 'inputs', 'tokens', 'outputs'])
+
+
+def _align(offset):
+    return -(-offset // 8) * 8
+
+
+def _layout(num_rows, num_concepts, sentence_len):
+    """Offsets of the inputs, tokens and outputs sections."""
+    inputs = _align(HEADER_DTYPE.itemsize)
+    tokens = _align(inputs + num_rows * -(-num_concepts // 8))
+    outputs = _align(tokens + num_rows * sentence_len)
+    return inputs, tokens, outputs
+
+
+def save_lexicon(path, inputs, tokens, vocab_size, outputs=None):
+    """Write binary `inputs` (num_rows, num_concepts), their utterance
+    `tokens` (num_rows, sentence_len) and optionally the decoder `outputs`."""
+    inputs = np.asarray(inputs, dtype=np.uint8)
+    tokens = np.asarray(tokens, dtype=np.uint8)
+    num_rows, num_concepts = inputs.shape
+    sentence_len = tokens.shape[1]
+    header = np.zeros((), dtype=HEADER_DTYPE)
+    header['magic'] = MAGIC
+    header['version'] = VERSION
+    header['num_concepts'] = num_concepts
+    header['sentence_len'] = sentence_len
+    header['vocab_size'] = vocab_size
+    header['has_outputs'] = outputs is not None
+    header['num_rows'] = num_rows
+    offsets = _layout(num_rows, num_concepts, sentence_len)
+    sections = [np.packbits(inputs, axis=1, bitorder='little'), tokens]
+    if outputs is not None:
+        sections.append(np.asarray(outputs, dtype='<f2'))
+    with open(path, 'wb') as f:
+        f.write(header.tobytes())
+        for offset, section in zip(offsets, sections):
+            f.write(b'\0' * (offset - f.tell()))
+            f.write(np.ascontiguousarray(section).tobytes())
+
+
+def load_lexicon(path):
+    """Memory-map a lexicon file. `inputs` stays bit-packed; see
+    `unpack_inputs`."""
+    header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)[0]
+    if header['magic'] != MAGIC:
+        raise ValueError(f"{path} is not a lexicon file")
+    if header['version'] != VERSION:
+        raise ValueError(f"unsupported lexicon version {header['version']}")
+    num_rows = int(header['num_rows'])
+    num_concepts = int(header['num_concepts'])
+    sentence_len = int(header['sentence_len'])
+    offsets = _layout(num_rows, num_concepts, sentence_len)
+
+    def section(offset, dtype, width):
+        if num_rows == 0:
+            return np.zeros((0, width), dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode='r', offset=offset,
+                shape=(num_rows, width))
+
+    outputs = None
+    if header['has_outputs']:
+        outputs = section(offsets[2], '<f2', num_concepts)
+    return Lexicon(
+            num_concepts=num_concepts,
+            vocab_size=int(header['vocab_size']),
+            inputs=section(offsets[0], np.uint8, -(-num_concepts // 8)),
+            tokens=section(offsets[1], np.uint8, sentence_len),
+            outputs=outputs,
+            )
+
+
+def unpack_inputs(lexicon):
+    """The lexicon's inputs as a (num_rows, num_concepts) uint8 array."""
+    return np.unpackbits(lexicon.inputs, axis=1, count=lexicon.num_concepts,
+            bitorder='little')
+
+
+def export_lexicon(model, path, with_outputs=True, chunk_size=2**12):
+    """Write the argmax utterance (and decoder output) of a trained model for
+    every input in its concept space."""
+    n = model.cfg['num_concepts']
+    inputs = space.index_bits(np.arange(2**n), n)
+    tokens = model.lexicon(chunk_size)
+    outputs = None
+    if with_outputs:
+        outputs = model.decode_tokens(tokens, chunk_size)
+    save_lexicon(path, inputs, tokens, model.cfg['vocab_size'], outputs)
@@ -0,0 +1,187 @@
+"""Compositionality metrics over an emitted lexicon: topographic similarity
+and positional and bag-of-symbols disentanglement.
+
+Every metric takes binary `inputs` (num_rows, num_concepts) and their
+utterance `tokens` (num_rows, sentence_len), e.g. from `load_lexicon`, and
+works through the rows in chunks. Distances between inputs and between
+utterances are small integers, so topographic similarity only needs a joint
+histogram of the two distances, never the N^2 distance matrices themselves.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+# `low` and `high` bound a 95% confidence interval; they equal `value` for
+# exact computations
+Estimate = namedtuple('Estimate', ['value', 'low', 'high'])
+
+
+def hamming(a, b):
+    """Hamming distance between matching rows of `a` and `b` (broadcast)."""
+    return (a != b).sum(-1)
+
+
+def edit_distance(a, b):
+    """Levenshtein distance between matching rows of two token arrays,
+    vectorized over rows."""
+    a, b = np.broadcast_arrays(a, b)
+    shape = a.shape[:-1]
+    a = a.reshape(-1, a.shape[-1])
+    b = b.reshape(-1, b.shape[-1])
+    prev = np.broadcast_to(np.arange(b.shape[1] + 1), (len(a), b.shape[1] + 1))
+    for i in range(1, a.shape[1] + 1):
+        cur = np.empty_like(prev)
+        cur[:, 0] = i
+        for j in range(1, b.shape[1] + 1):
+            cur[:, j] = np.minimum.reduce([
+                prev[:, j] + 1,
+                cur[:, j - 1] + 1,
+                prev[:, j - 1] + (a[:, i - 1] != b[:, j - 1]),
+                ])
+        prev = cur
+    return prev[:, -1].reshape(shape)
+
+
+DISTANCES = {'hamming': hamming, 'edit': edit_distance}
+
+
+def spearman_from_counts(counts):
+    """Spearman correlation, with tied values given their average rank, of
+    paired integer observations summarized as counts[x, y]."""
+    counts = counts.astype(np.float64)
+    total = counts.sum()
+
+    def ranks(marginal):
+        return np.cumsum(marginal) - marginal + (marginal + 1) / 2
+
+    cx, cy = counts.sum(1), counts.sum(0)
+    rx, ry = ranks(cx), ranks(cy)
+    rx = rx - (cx * rx).sum() / total
+    ry = ry - (cy * ry).sum() / total
+    cov = rx @ counts @ ry
+    var = np.sqrt((cx * rx**2).sum() * (cy * ry**2).sum())
+    return cov / var if var else np.nan
+
+
+def topographic_similarity(inputs, tokens, distance='hamming', num_pairs=None,
+        seed=None, max_elements=2**24):
+    """Spearman correlation between the Hamming distances of inputs and the
+    `distance` ('hamming' or 'edit') between their utterances over all
+    pairs, computed exactly in chunks of at most `max_elements` compared
+    values. With `num_pairs`, estimate it from that many random pairs
+    instead; the interval then uses the Fisher transform with the
+    Fieller-Hartley-Pearson variance 1.06 / (num_pairs - 3), which treats
+    the pairs as independent."""
+    inputs = np.asarray(inputs, dtype=np.uint8)
+    tokens = np.asarray(tokens)
+    utt_distance = DISTANCES[distance]
+    n, sentence_len = inputs.shape[1], tokens.shape[1]
+    counts = np.zeros((n + 1) * (sentence_len + 1), dtype=np.int64)
+
+    def accumulate(d_in, d_utt):
+        nonlocal counts
+        counts += np.bincount((d_in * (sentence_len + 1) + d_utt).ravel(),
+                minlength=len(counts))
+
+    if num_pairs is None:
+        rows = len(inputs)
+        width = max(n, sentence_len**2 if distance == 'edit' else sentence_len)
+        chunk = max(1, max_elements // (rows * width))
+        for start in range(0, rows, chunk):
+            stop = min(start + chunk, rows)
+            # Pairs (i, j) with i in this chunk and j > i
+            upper = np.arange(start, rows) > np.arange(start, stop)[:, None]
+            d_in = hamming(inputs[start:stop, None], inputs[None, start:])
+            d_utt = utt_distance(tokens[start:stop, None],
+                    tokens[None, start:])
+            accumulate(d_in[upper], d_utt[upper])
+        rho = spearman_from_counts(counts.reshape(n + 1, sentence_len + 1))
+        return Estimate(rho, rho, rho)
+
+    rng = np.random.RandomState(seed)
+    i = rng.randint(len(inputs), size=num_pairs)
+    # Offset j so that it never equals i
+    j = (i + rng.randint(1, len(inputs), size=num_pairs)) % len(inputs)
+    chunk = max(1, max_elements // max(n, sentence_len**2))
+    for a in range(0, num_pairs, chunk):
+        b = a + chunk
+        accumulate(hamming(inputs[i[a:b]], inputs[j[a:b]]),
+                utt_distance(tokens[i[a:b]], tokens[j[a:b]]))
+    rho = spearman_from_counts(counts.reshape(n + 1, sentence_len + 1))
+    z = np.arctanh(np.clip(rho, -1 + 1e-12, 1 - 1e-12))
+    half = 1.96 * np.sqrt(1.06 / max(num_pairs - 3, 1))
+    return Estimate(rho, np.tanh(z - half), np.tanh(z + half))
+
+
+def entropy(p, axis):
+    """Entropy in nats of distributions given as (unnormalized) counts."""
+    p = p / p.sum(axis=axis, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return -np.nansum(p * np.log(p), axis=axis)
+
+
+def mutual_information(joint):
+    """Mutual information between the two last axes of joint counts."""
+    return (entropy(joint.sum(-1), -1) + entropy(joint.sum(-2), -1)
+            - entropy(joint.reshape(joint.shape[:-2] + (-1,)), -1))
+
+
+def _gap_score(joint):
+    """Mean over the symbol variables of (largest - second largest MI with a
+    concept) / entropy of the symbol variable, given joint counts indexed
+    [variable, concept, variable value, concept value]; variables with zero
+    entropy are skipped."""
+    mi = np.sort(mutual_information(joint), axis=1)
+    h = entropy(joint[:, 0].sum(-1), -1)
+    valid = h > 0
+    if not valid.any():
+        return np.nan
+    return ((mi[valid, -1] - mi[valid, -2]) / h[valid]).mean()
+
+
+def _joint_counts(inputs, values, num_values, chunk_size):
+    """Counts [variable, concept, value, concept bit] of `values`
+    (num_rows, num_variables) against the input bits."""
+    inputs = np.asarray(inputs, dtype=np.int64)
+    joint = np.zeros((values.shape[1], inputs.shape[1], num_values, 2))
+    for start in range(0, len(inputs), chunk_size):
+        v = np.eye(num_values)[values[start:start + chunk_size]]
+        a = np.eye(2)[inputs[start:start + chunk_size]]
+        joint += np.einsum('cjv,cka->jkva', v, a)
+    return joint
+
+
+def positional_disentanglement(inputs, tokens, vocab_size, chunk_size=2**14):
+    """How much each utterance position is dedicated to a single concept
+    (Chaabouni et al., 2020)."""
+    if np.asarray(inputs).shape[1] < 2:
+        return np.nan
+    joint = _joint_counts(inputs, np.asarray(tokens, dtype=np.int64),
+            vocab_size, chunk_size)
+    return _gap_score(joint)
+
+
+def bos_disentanglement(inputs, tokens, vocab_size, chunk_size=2**14):
+    """Bag-of-symbols disentanglement: how much the number of occurrences of
+    each symbol is dedicated to a single concept (Chaabouni et al., 2020)."""
+    if np.asarray(inputs).shape[1] < 2:
+        return np.nan
+    tokens = np.asarray(tokens, dtype=np.int64)
+    symbol_counts = np.stack([(tokens == v).sum(-1)
+        for v in range(vocab_size)], axis=1)
+    joint = _joint_counts(inputs, symbol_counts, tokens.shape[1] + 1,
+            chunk_size)
+    return _gap_score(joint)
+
+
+def compositionality(inputs, tokens, vocab_size, num_pairs=None, seed=None):
+    """All metrics for one lexicon, as a dict."""
+    topsim = topographic_similarity(inputs, tokens, num_pairs=num_pairs,
+            seed=seed)
+    return {
+        'topsim': topsim.value,
+        'topsim_low': topsim.low,
+        'topsim_high': topsim.high,
+        'posdis': positional_disentanglement(inputs, tokens, vocab_size),
+        'bosdis': bos_disentanglement(inputs, tokens, vocab_size),
+    }
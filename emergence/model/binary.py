@@ -1,3 +1,6 @@
+import os
+import time
+
 import numpy as np
 import tensorflow as tf
 import tensorflow.keras
@@ -5,150 +8,229 @@ from tensorflow.keras.models import Model
 from tensorflow.keras.layers import (Dense, Dropout, Input, Concatenate,
         BatchNormalization, RepeatVector, Lambda, Flatten)
 from tensorflow.keras.initializers import RandomNormal
-from tensorflow_probability.python.distributions import RelaxedOneHotCategorical
-from numpy.random import shuffle
-from numpy.linalg import matrix_rank
 
-from .. import util
+from .. import data, frozen, space, summaries, util
+from ..defaults import BINARY_CFG
+from ..schedule import EarlyStopping
+from ..profiling import StepProfiler
+from .numpy_binary import glorot_uniform, truncated_normal
 
 class Binary:
     """A model describing communicating an arbitrary vecotr which is first
     transformed into a random embedding."""
 
-    @staticmethod
-    def train_test_split(arr, test_split=1.0):
-        """Roughly split the data ensuring that the train set has a span of the
-        whole space."""
-        indexes = list(range(len(arr)))
-        shuffle(indexes)
-        train, test = [], []
-        n = arr.shape[1]
-        covered = []
-        for i in indexes:
-            mr_covered = matrix_rank(covered)
-            if sum(arr[i]) == 0.:
-                continue
-                # The zero vector is a degenerate case, and I do not believe it
-                # is worth including
-                #test.append(i)
-                #train.append(i)
-            if mr_covered == n:
-                if len(test)/len(arr) < test_split:
-                    test.append(i)
-                else:
-                    train.append(i)
-            else:
-                covered.append(arr[i])
-                train.append(i)
+    span_basis_add = staticmethod(space.span_basis_add)
+    train_test_split = staticmethod(space.train_test_split)
+    index_bits = staticmethod(space.index_bits)
+    permutations = staticmethod(space.permutations)
+    permutation_chunks = staticmethod(space.permutation_chunks)
 
-        return train, test 
+    default_cfg = BINARY_CFG
 
-    @staticmethod
-    def permutations(n):
-        ma = [2**i for i in range(n)]
-        arr = []
-        for i in range(2**n):
-            arr.append([i//b % 2 for b in ma])
-        return np.array(arr)
-
-    default_cfg = {
-        # Actual batch_size == batch_size * num_concepts
-        'batch_size': 7,
-        'epochs': 5000,
-         # How often to anneal temperature
-         # More like a traditional epoch due to small dataset size
-        'superepoch': 200,
-        'e_dense_size': 14,
-        'd_dense_size': 2,
-        'input_dim': 8,
-        'num_concepts': 7,
-        'sentence_len': 7,
-        'vocab_size': 2,
-
-        'learning_rate': 1e-2,
-        'temp_init': 3,
-        'temp_decay': 0.85,
-        'train_st': False,
-        'test_prop': 0.1,
-        'dropout_rate': 0.2,
-    }
+    # Config which determines the graph; a model can be reset for a new run
+    # with any other change (see `reset` and `BinaryHandle`). The seed is
+    # applied at run time, see `seed_variables` and `noise_seed`.
+    graph_keys = ['num_concepts', 'input_dim', 'e_dense_size',
+            'd_dense_size', 'sentence_len', 'vocab_size', 'superepoch',
+            'decoder', 'backend', 'intra_op_threads', 'inter_op_threads']
+
+    def __new__(cls, cfg=None, logdir='log'):
+        if cls is Binary and cfg is not None and cfg.get('backend') == 'numpy':
+            from .numpy_binary import NumpyBinary
+            return NumpyBinary(cfg, logdir)
+        return super().__new__(cls)
 
     def __init__(self, cfg=None, logdir='log'):
         if cfg is None:
             self.cfg = Binary.default_cfg
         else:
             self.cfg = {**Binary.default_cfg, **cfg} 
-        self.sess = tf.Session()
+        self.sess = self.new_session()
+        self.saver = None
         self.initialize_graph()
+        self.initialize_run(logdir)
+
+    def initialize_run(self, logdir):
+        """Set up the data, summaries, profiler and checkpoints of a run."""
+        self.logdir = logdir
+        if self.cfg['seed'] is not None:
+            self.seed_variables(self.cfg['seed'])
         self.generate_train_and_test()
-        self.train_writer = tf.summary.FileWriter(
-                logdir + '/train',
-                self.sess.graph
-                )
-        self.test_writer = tf.summary.FileWriter(
-                logdir + '/test',
-                self.sess.graph
-                )
+        self.summaries = summaries.make_sink(self.cfg, logdir,
+                self.sess.graph)
+        self.profiler = None
+        if self.cfg['profile_steps']:
+            self.profiler = StepProfiler(self.cfg['profile_steps'], logdir,
+                    self.summaries.writer('train'))
+        self.checkpoint_dir = os.path.join(logdir, 'checkpoints')
+        self.checkpoints_recovered = False
+        self.start_epoch = 0
+        if self.cfg['warm_start'] is not None:
+            self.warm_start(self.cfg['warm_start'])
+        if self.cfg['resume']:
+            self.restore_checkpoint()
+
+    def new_session(self):
+        return tf.Session(config=tf.ConfigProto(
+            intra_op_parallelism_threads=self.cfg['intra_op_threads'],
+            inter_op_parallelism_threads=self.cfg['inter_op_threads'],
+            ))
 
-    def gs_sampler(self, logits):
+    @staticmethod
+    def graph_key(cfg):
+        return tuple(cfg[k] for k in Binary.graph_keys)
+
+    def reset(self, cfg=None, logdir='log'):
+        """Start a new run on the existing graph and session, reinitializing
+        every variable. `cfg` may change anything but the graph keys."""
+        cfg = {**Binary.default_cfg, **(cfg or {})}
+        changed = [k for k in Binary.graph_keys if cfg[k] != self.cfg[k]]
+        if changed:
+            raise ValueError(f"cannot reset with a different {changed}")
+        self.close_run()
+        self.cfg = cfg
+        self.sess.run(self.init_op)
+        self.initialize_run(logdir)
+
+    def close_run(self):
+        """Flush the summaries and stop the sampled data thread of the
+        current run."""
+        self.summaries.close()
+        if self.train_batches is not None:
+            self.train_batches.close()
+
+    def close(self):
+        self.close_run()
+        self.sess.close()
+
+    def seed_variables(self, seed):
+        """Redraw the randomly initialized variables from a RandomState(seed),
+        in the order and with the distributions NumpyBinary uses, so that a
+        seeded run starts from the same weights on a new or a reused
+        graph."""
+        rng = np.random.RandomState(seed)
+        cfg = self.cfg
+        vocab_size, sentence_len = cfg['vocab_size'], cfg['sentence_len']
+        h0, word = self.encoder_layers[:2]
+        _, _, output, cls = self.decoder_layers
+        values = [
+            (self.e_embeddings_w, truncated_normal(rng, 1e0,
+                (cfg['num_concepts'], cfg['input_dim']))),
+            (h0.kernel, glorot_uniform(rng, cfg['input_dim'],
+                cfg['e_dense_size'])),
+            (word.kernel, glorot_uniform(rng, cfg['e_dense_size'],
+                vocab_size * sentence_len)),
+            (self.d_fc_w, truncated_normal(rng, 1e-2,
+                (1, vocab_size, cfg['d_dense_size']))),
+            (output.kernel, glorot_uniform(rng,
+                sentence_len * cfg['d_dense_size'], cfg['input_dim'])),
+            (cls.kernel, glorot_uniform(rng, cfg['input_dim'],
+                cfg['num_concepts'])),
+        ]
+        for var, value in values:
+            var.load(value, self.sess)
+
+    @staticmethod
+    def stream_seed(noise_seed, stream):
+        """The seed of one of the two noise streams (0: Gumbel, 1: dropout)
+        of a step seeded with `noise_seed`."""
+        return tf.stack([noise_seed[0], 2 * noise_seed[1] + stream])
+
+    def gs_sampler(self, logits, temperature=None, straight_through=None,
+            noise_seed=None):
         """Sampling function for Gumbel-Softmax"""
-        dist = RelaxedOneHotCategorical(temperature=self.temperature, logits=logits)
-        sample = dist.sample()
+        if temperature is None:
+            temperature = self.temperature
+        if straight_through is None:
+            straight_through = self.straight_through
+        if noise_seed is None:
+            noise_seed = self.noise_seed
+        # A sample of RelaxedOneHotCategorical, drawn from a stateless op so
+        # that the noise is a function of the fed seed
+        uniform = tf.random.stateless_uniform(tf.shape(logits),
+                Binary.stream_seed(noise_seed, 0),
+                minval=np.finfo(np.float32).tiny, maxval=1.)
+        gumbel = -tf.log(-tf.log(uniform))
+        sample = tf.nn.softmax((logits + gumbel) / temperature)
         y_hard = tf.one_hot(tf.argmax(sample, -1), self.cfg['vocab_size'])
         # y_hard is the value that gets used but the gradient flows through logits
         y = tf.stop_gradient(y_hard - logits) + logits
 
-        return tf.cond(self.straight_through, lambda: y, lambda: sample)
+        return tf.cond(straight_through, lambda: y, lambda: sample)
 
     def initialize_encoder(self):
         unstopped_inputs = Input(shape=(self.cfg['num_concepts'],), name='e_input')
         self.e_inputs = tf.stop_gradient(unstopped_inputs)
 
         # Generate a static vector space of "concepts"
-        e_embeddings_w = tf.Variable(
+        self.e_embeddings_w = tf.Variable(
                 tf.initializers.truncated_normal(0, 1e0)(
                     (self.cfg['num_concepts'], self.cfg['input_dim'])),
                 dtype=tf.float32,
                 trainable=False,
                 )
-            
-        e_x = tf.matmul(self.e_inputs, e_embeddings_w)
 
         # Dense layer for encocder
-        e_x = Dense(self.cfg['e_dense_size'],
-                activation='relu',
-                name='encoder_h0')(e_x)
-        #e_x = tf.layers.batch_normalization(e_x, renorm=True)
-        e_x = Dense(self.cfg['vocab_size']*self.cfg['sentence_len'],
-                name="encoder_word_dense")(e_x)
-
-        self.e_raw_output = tf.keras.layers.Reshape((self.cfg['sentence_len'],
-                self.cfg['vocab_size']))(e_x)
+        self.encoder_layers = [
+                Dense(self.cfg['e_dense_size'],
+                    activation='relu',
+                    name='encoder_h0'),
+                #tf.layers.BatchNormalization(renorm=True),
+                Dense(self.cfg['vocab_size']*self.cfg['sentence_len'],
+                    name="encoder_word_dense"),
+                tf.keras.layers.Reshape((self.cfg['sentence_len'],
+                    self.cfg['vocab_size'])),
+                ]
+        self.e_raw_output = self.encode(self.e_inputs)
+
+    def encode(self, inputs):
+        """Apply the encoder layers to a batch of concept vectors."""
+        e_x = tf.matmul(inputs, self.e_embeddings_w)
+        for layer in self.encoder_layers:
+            e_x = layer(e_x)
+        return e_x
 
     def initialize_communication(self):
-        categorical_output = self.gs_sampler
+        self.utterance, self.utt_dropout = self.communicate(self.e_raw_output)
+        self.tokens = tf.argmax(self.utterance, -1)
+
+    def communicate(self, e_raw_output, use_argmax=None, temperature=None,
+            straight_through=None, dropout_rate=None, noise_seed=None):
+        """Select words from the encoder logits and apply word dropout;
+        hyperparameters not given default to their placeholders."""
+        if use_argmax is None:
+            use_argmax = self.use_argmax
+        if dropout_rate is None:
+            dropout_rate = self.dropout_rate
+        if noise_seed is None:
+            noise_seed = self.noise_seed
+        categorical_output = lambda x: self.gs_sampler(x, temperature,
+                straight_through, noise_seed)
 
         argmax_selector = lambda: tf.one_hot(
-                tf.argmax(self.e_raw_output, -1),
-                self.e_raw_output.shape[-1]
+                tf.argmax(e_raw_output, -1),
+                e_raw_output.shape[-1]
                 )
-        gumbel_softmax_selector = lambda: Lambda(categorical_output)(self.e_raw_output)
-        self.utterance = tf.cond(self.use_argmax,
+        gumbel_softmax_selector = lambda: Lambda(categorical_output)(e_raw_output)
+        utterance = tf.cond(use_argmax,
                 argmax_selector,
                 gumbel_softmax_selector,
                 name="argmax_cond",
                 )
 
-        dropout_lambda = Lambda(
-                lambda x: tf.layers.dropout(
-                    x,
-                    noise_shape=(tf.shape(self.utterance)[0], self.cfg['sentence_len'], 1),
-                    rate=self.dropout_rate,
-                    training=tf.logical_not(self.use_argmax),
-                    ),
-                name="dropout_lambda",
-                )
-        self.utt_dropout = dropout_lambda(self.utterance)
+        def word_dropout(x):
+            # Drops whole words like tf.layers.dropout with a noise_shape of
+            # (batch, sentence_len, 1), but with stateless noise
+            uniform = tf.random.stateless_uniform(
+                    (tf.shape(x)[0], self.cfg['sentence_len'], 1),
+                    Binary.stream_seed(noise_seed, 1))
+            keep = tf.cast(uniform >= dropout_rate, x.dtype)
+            return tf.cond(use_argmax,
+                    lambda: x,
+                    lambda: x * keep / (1 - dropout_rate))
+
+        dropout_lambda = Lambda(word_dropout, name="dropout_lambda")
+        return utterance, dropout_lambda(utterance)
 
     def initialize_decoder(self):
         weight_shape = (
@@ -161,39 +243,122 @@ class Binary:
                 1, # Extra dim used below
                 self.cfg['d_dense_size'],
                 )
-        d_fc_w = tf.Variable(
+        self.d_fc_w = tf.Variable(
                 tf.initializers.truncated_normal(
                     0., 1e-2)(tf.constant(weight_shape)),
                 dtype=tf.float32,
                 expected_shape=weight_shape,
                 )
-        d_fc_b = tf.Variable(
+        self.d_fc_b = tf.Variable(
                 tf.constant(1e-1, shape=bias_shape),
                 dtype=tf.float32,
                 expected_shape=bias_shape,
                 )
+        self.decoder_layers = [
+                Flatten(name='decoder_flatten'),
+                # Equivalent to tf.layers.batch_normalization(d_x, renorm=True)
+                tf.layers.BatchNormalization(renorm=True),
+                Dense(self.cfg['input_dim'], activation=None,
+                    name='decoder_output'),
+                Dense(self.cfg['num_concepts'],
+                    name="decoder_class",
+                    activation=None,),
+                ]
+        self.d_output = self.decode(self.utt_dropout)
+        self.d_sigmoid = tf.nn.sigmoid(self.d_output)
 
-        batch_size = tf.shape(self.utt_dropout)[0]
+    def decode(self, utt_dropout):
+        """Apply the decoder to a batch of (dropped out) utterances and return
+        the logits."""
+        if self.cfg['decoder'] == 'tile':
+            d_x = self.decode_positions_tiled(utt_dropout)
+        else:
+            # The same weights for every position, contracted in one op
+            d_x = tf.einsum('blv,vd->bld', utt_dropout, self.d_fc_w[0])
+            d_x = tf.nn.relu(d_x + self.d_fc_b[:, 0])
+        for layer in self.decoder_layers:
+            d_x = layer(d_x)
+        return d_x
+
+    def decode_positions_tiled(self, utt_dropout):
+        """The original per-position layer, which copies the weights for
+        every example and position; kept for comparison."""
+        weight_shape = tuple(self.d_fc_w.shape.as_list())
+        batch_size = tf.shape(utt_dropout)[0]
 
         tiled = tf.reshape(
-                tf.tile(d_fc_w, (batch_size, self.cfg['sentence_len'], 1)),
+                tf.tile(self.d_fc_w, (batch_size, self.cfg['sentence_len'], 1)),
                 (batch_size,) + (self.cfg['sentence_len'],) + weight_shape[1:],
                 )
         utt_dropout_reshaped = tf.reshape(
-                self.utt_dropout,
+                utt_dropout,
                 (-1, self.cfg['sentence_len'], 1, self.cfg['vocab_size']))
 
-        d_x = tf.nn.relu(tf.matmul(utt_dropout_reshaped, tiled) + d_fc_b)
-        d_x = Flatten(name='decoder_flatten')(d_x)
-
-        d_x = tf.layers.batch_normalization(d_x, renorm=True)
-
-        d_x = Dense(self.cfg['input_dim'], activation=None,
-                name='decoder_output')(d_x)
-        self.d_output = Dense(self.cfg['num_concepts'],
-                name="decoder_class",
-                activation=None,)(d_x)
-        self.d_sigmoid = tf.nn.sigmoid(self.d_output)
+        return tf.nn.relu(tf.matmul(utt_dropout_reshaped, tiled) + self.d_fc_b)
+
+    def initialize_multistep(self):
+        """Build an op which runs `num_steps` optimizer steps in a single
+        session call on training data preloaded into a variable, annealing
+        the temperature on-device."""
+        n = self.cfg['num_concepts']
+        self.train_data_init = tf.placeholder(tf.float32, shape=(None, n),
+                name='train_data_init')
+        # Kept out of the global collection; it is initialized from the
+        # placeholder once the data has been generated
+        train_data = tf.Variable(self.train_data_init, trainable=False,
+                validate_shape=False, collections=[], name='train_data')
+        self.train_data = train_data
+        self.train_weights_init = tf.placeholder(tf.float32, shape=(None,),
+                name='train_weights_init')
+        train_weights = tf.Variable(self.train_weights_init, trainable=False,
+                validate_shape=False, collections=[], name='train_weights')
+        self.train_weights = train_weights
+        self.temp_var = tf.Variable(float(self.cfg['temp_init']),
+                trainable=False, name='temperature')
+        self.first_step = tf.placeholder(tf.int32, shape=(), name='first_step')
+        self.num_steps = tf.placeholder(tf.int32, shape=(), name='num_steps')
+        inputs = tf.reshape(train_data, (-1, n))
+        weights = tf.reshape(train_weights, (-1, 1))
+
+        def body(i):
+            # Reads of the temperature must wait for the previous iteration
+            with tf.control_dependencies([i]):
+                temperature = tf.identity(self.temp_var)
+            # The same scopes as the single-step graph, so that profiles
+            # attribute the loop's ops to their components
+            with tf.name_scope("encoder"):
+                encoded = self.encode(inputs)
+            with tf.name_scope("communication"):
+                utterance, utt_dropout = self.communicate(
+                        encoded,
+                        use_argmax=tf.constant(False),
+                        temperature=temperature,
+                        noise_seed=tf.stack([self.multistep_seed,
+                            tf.cast(i, tf.int64)]),
+                        )
+            with tf.name_scope("decoder"):
+                logits = self.decode(utt_dropout)
+            with tf.name_scope("training"):
+                loss = tf.nn.sigmoid_cross_entropy_with_logits(
+                        logits=logits, labels=inputs)
+                step = self.optimizer.minimize(loss * weights)
+            with tf.control_dependencies([step]):
+                annealed = tf.where(
+                        tf.equal(i % self.cfg['superepoch'], 0),
+                        temperature * self.temp_decay,
+                        temperature,
+                        )
+                anneal = tf.assign(self.temp_var, annealed)
+            with tf.control_dependencies([anneal]):
+                return i + 1
+
+        self.multistep_op = tf.while_loop(
+                lambda i: i < self.first_step + self.num_steps,
+                body,
+                [self.first_step],
+                parallel_iterations=1,
+                back_prop=False,
+                )
 
     def initialize_graph(self):
         with tf.name_scope("hyperparameters"):
@@ -205,6 +370,24 @@ class Binary:
                     name='temperature')
             self.straight_through = tf.placeholder(tf.bool, shape=(),
                     name='straight_through')
+            # Fed on every training step so that a reset model can use new
+            # values
+            self.learning_rate = tf.placeholder_with_default(
+                    float(self.cfg['learning_rate']), shape=(),
+                    name='learning_rate')
+            self.temp_decay = tf.placeholder_with_default(
+                    float(self.cfg['temp_decay']), shape=(),
+                    name='temp_decay')
+            # The Gumbel and dropout noise of a step is a function of
+            # (run seed, step) fed here, or in the multistep loop of
+            # multistep_seed and the step; unseeded runs leave them to
+            # random defaults
+            self.noise_seed = tf.placeholder_with_default(
+                    tf.random.uniform((2,), maxval=2**62, dtype=tf.int64),
+                    shape=(2,), name='noise_seed')
+            self.multistep_seed = tf.placeholder_with_default(
+                    tf.random.uniform((), maxval=2**62, dtype=tf.int64),
+                    shape=(), name='multistep_seed')
 
         with tf.name_scope("environment"):
             with tf.name_scope("encoder"):
@@ -215,30 +398,56 @@ class Binary:
                 self.initialize_decoder()
 
         with tf.name_scope("training"):
-            optmizier = tf.train.AdamOptimizer(self.cfg['learning_rate'])
+            self.optimizer = tf.train.AdamOptimizer(self.learning_rate)
             self.loss = tf.nn.sigmoid_cross_entropy_with_logits(
                     logits=self.d_output, labels=self.e_inputs)
-            tf.summary.scalar('loss', tf.reduce_mean(self.loss))
-
-            self.train_step = optmizier.minimize(self.loss)
+            self.mean_loss = tf.reduce_mean(self.loss)
+            # Fraction of inputs reconstructed exactly
+            self.accuracy = tf.reduce_mean(tf.cast(tf.reduce_all(
+                tf.equal(tf.cast(self.d_output > 0, tf.float32),
+                    self.e_inputs),
+                axis=-1), tf.float32))
+
+            # Per-example loss weights, used in place of repeating examples
+            self.example_weights = tf.placeholder_with_default(
+                    tf.ones_like(self.e_inputs[:, 0]),
+                    shape=(None,),
+                    name='example_weights',
+                    )
+            self.train_step = self.optimizer.minimize(
+                    self.loss * self.example_weights[:, None])
+
+        with tf.name_scope("inference"):
+            self.utt_tokens = tf.placeholder(tf.int32,
+                    shape=(None, self.cfg['sentence_len']), name='utt_tokens')
+            self.decoded = tf.nn.sigmoid(self.decode(
+                tf.one_hot(self.utt_tokens, self.cfg['vocab_size'])))
+
+        # Built after train_step so that the Adam slots are shared
+        with tf.name_scope("multistep"):
+            self.initialize_multistep()
 
         self.init_op = tf.initializers.global_variables()
         self.sess.run(self.init_op)
-        self.summary = tf.summary.merge_all()
 
     def generate_train_and_test(self):
-        all_input = Binary.permutations(self.cfg['num_concepts'])
-        shuffle(all_input)
-        train_i, test_i = Binary.train_test_split(
-                all_input,
-                self.cfg['test_prop']
-                )
-        train_i = np.repeat(train_i, self.cfg['batch_size'], axis=0)
-        shuffle(train_i)
-
-        # Inputs and labels are the same, so duplciate them
-        train_data = all_input[train_i]
-        test_data = all_input[test_i]
+        self.train_batches = None
+        train_weights = None
+        if self.cfg['data_mode'] == 'sampled':
+            self.train_batches = data.prefetch(data.sample_train_batches(
+                self.cfg['num_concepts'],
+                self.cfg['samples_per_step'],
+                self.cfg['test_prop'],
+                seed=self.cfg['seed'],
+                ))
+            train_data = next(self.train_batches)
+            test_data = data.test_sample(
+                    self.cfg['num_concepts'],
+                    self.cfg['num_test_samples'],
+                    self.cfg['test_prop'],
+                    )
+        else:
+            train_data, test_data, train_weights = self.split_space()
 
         self.train_fd = {
             self.e_inputs.name: train_data,
@@ -246,7 +455,10 @@ class Binary:
             self.straight_through.name: self.cfg['train_st'],
             self.dropout_rate.name: self.cfg['dropout_rate'],
             self.use_argmax.name: False,
+            self.learning_rate.name: self.cfg['learning_rate'],
         }
+        if train_weights is not None:
+            self.train_fd[self.example_weights.name] = train_weights
         self.test_fd = {
             self.e_inputs.name: test_data,
             self.temperature.name: self.cfg['temp_init'], # Unused
@@ -256,34 +468,257 @@ class Binary:
         }
         #return train_data, test_data
 
+    def split_space(self):
+        """Split the enumerated input space, returning the train data, test
+        data and the train example weights (None unless weighted)."""
+        # train_test_split already shuffles, so the space stays in order
+        all_input = Binary.permutations(self.cfg['num_concepts'])
+        train_i, test_i = Binary.train_test_split(
+                all_input,
+                self.cfg['test_prop'],
+                seed=self.cfg['seed'],
+                )
+        train_weights = None
+        if self.cfg['weighted_examples']:
+            train_weights = np.full(len(train_i), self.cfg['batch_size'],
+                    dtype=np.float32)
+        else:
+            train_i = np.repeat(train_i, self.cfg['batch_size'], axis=0)
+        np.random.RandomState(self.cfg['seed']).shuffle(train_i)
+
+        # Inputs and labels are the same, so duplciate them
+        return all_input[train_i], all_input[test_i], train_weights
+
     def run(self, verbose=False):
         # The labels are unused because they are the same as the input
-        for i in range(self.cfg['epochs']):
-            self.sess.run(self.train_step, feed_dict=self.train_fd)
-            if i % self.cfg['superepoch'] == 0:
-                self.train_fd[self.temperature.name] *= self.cfg['temp_decay']
-
-                train_fd_use_argmax = {
-                        **self.train_fd,
-                        self.use_argmax.name: True
-                        }
-                superepoch = i // self.cfg['superepoch']
-                summary = self.sess.run(
-                        self.summary,
-                        feed_dict=train_fd_use_argmax
-                        )
-                self.train_writer.add_summary(summary, superepoch)
-                summary = self.sess.run(self.summary, feed_dict=self.test_fd)
-                self.test_writer.add_summary(summary, superepoch)
+        start = time.perf_counter()
+        self.stopping = (EarlyStopping(self.cfg)
+                if self.cfg['early_stopping'] else None)
+        self.epochs_run = self.cfg['epochs']
+        if self.cfg['steps_per_call'] > 1:
+            if self.train_batches is not None:
+                raise ValueError("the sampled data mode needs steps_per_call "
+                        "== 1 since the multi-step loop reuses one batch")
+            self.run_multistep(verbose)
+        else:
+            for i in range(self.start_epoch, self.cfg['epochs']):
+                if self.train_batches is not None:
+                    self.train_fd[self.e_inputs.name] = next(self.train_batches)
+                if self.cfg['seed'] is not None:
+                    self.train_fd[self.noise_seed.name] = (self.cfg['seed'], i)
+                if self.profiler is not None and i in self.profiler:
+                    self.profiler.run(self.sess, self.train_step,
+                            self.train_fd, i)
+                else:
+                    self.sess.run(self.train_step, feed_dict=self.train_fd)
+                if i % self.cfg['superepoch'] == 0:
+                    self.train_fd[self.temperature.name] *= self.cfg['temp_decay']
+                    self.write_summaries(i // self.cfg['superepoch'], verbose)
+                    if self.check_stopping():
+                        self.epochs_run = i + 1
+                        break
+                    self.periodic_checkpoint(i // self.cfg['superepoch'], i + 1)
+        elapsed = time.perf_counter() - start
+        if self.cfg['checkpoint_every']:
+            self.save_checkpoint(self.epochs_run)
+        self.summaries.flush()
+        steps = self.epochs_run - self.start_epoch
+        self.steps_per_sec = steps / elapsed if elapsed else 0.
+        self.epochs_saved = self.cfg['epochs'] - self.epochs_run
+        if verbose:
+            if self.epochs_saved:
+                print(f"stopped early ({self.stopping.reason}) after "
+                      f"{self.epochs_run} epochs, "
+                      f"saving {self.epochs_saved}")
+            print(f"{self.steps_per_sec:.1f} steps/sec")
+
+    def check_stopping(self):
+        """Return True if early stopping is enabled and the argmax channel
+        has converged or plateaued on the training set."""
+        if self.stopping is None:
+            return False
+        train = self.metrics['train']
+        return self.stopping.update(train['loss'], train['accuracy'])
+
+    def run_multistep(self, verbose=False):
+        """Train with `steps_per_call` optimizer steps per session call,
+        returning to Python only at superepoch boundaries."""
+        self.sess.run(self.train_data.initializer, feed_dict={
+            self.train_data_init: self.train_fd[self.e_inputs.name]})
+        train_weights = self.train_fd.get(
+                self.example_weights.name,
+                np.ones(len(self.train_fd[self.e_inputs.name])),
+                )
+        self.sess.run(self.train_weights.initializer, feed_dict={
+            self.train_weights_init: train_weights})
+        self.temp_var.load(self.train_fd[self.temperature.name], self.sess)
+        hp_fd = {
+            self.straight_through.name: self.train_fd[self.straight_through.name],
+            self.dropout_rate.name: self.train_fd[self.dropout_rate.name],
+            self.learning_rate.name: self.cfg['learning_rate'],
+            self.temp_decay.name: self.cfg['temp_decay'],
+        }
+        if self.cfg['seed'] is not None:
+            hp_fd[self.multistep_seed.name] = self.cfg['seed']
+        superepoch = self.cfg['superepoch']
+        i = self.start_epoch
+        while i < self.cfg['epochs']:
+            # Summaries are written after every step i where i % superepoch
+            # == 0, so no call may cross one of those steps
+            boundary = min(-(-i // superepoch) * superepoch,
+                    self.cfg['epochs'] - 1)
+            num_steps = min(self.cfg['steps_per_call'], boundary - i + 1)
+            fd = {
+                **hp_fd,
+                self.first_step: i,
+                self.num_steps: num_steps,
+            }
+            # The trace of a call covers all of its steps
+            if (self.profiler is not None
+                    and self.profiler.covers(i, i + num_steps)):
+                self.profiler.run(self.sess, self.multistep_op, fd, i)
+            else:
+                self.sess.run(self.multistep_op, feed_dict=fd)
+            i += num_steps
+            if (i - 1) % superepoch == 0:
+                self.train_fd[self.temperature.name] = self.sess.run(
+                        self.temp_var)
+                self.write_summaries((i - 1) // superepoch, verbose)
+                if self.check_stopping():
+                    self.epochs_run = i
+                    break
+                self.periodic_checkpoint((i - 1) // superepoch, i)
+
+    def periodic_checkpoint(self, superepoch, epoch):
+        every = self.cfg['checkpoint_every']
+        if every and superepoch % every == 0:
+            self.save_checkpoint(epoch)
+
+    def save_checkpoint(self, epoch):
+        """Save the variables (including the optimizer state) after `epoch`
+        completed epochs, along with the temperature and, unless the data is
+        sampled, the train/test split."""
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        path = self.checkpoint_saver().save(self.sess,
+                os.path.join(self.checkpoint_dir, 'model'),
+                global_step=epoch)
+        state = {
+            'epoch': epoch,
+            'temperature': self.train_fd[self.temperature.name],
+        }
+        if self.train_batches is None:
+            state['train_data'] = self.train_fd[self.e_inputs.name]
+            state['test_data'] = self.test_fd[self.e_inputs.name]
+            if self.example_weights.name in self.train_fd:
+                state['train_weights'] = self.train_fd[self.example_weights.name]
+        # Written after the variables, so a state file marks a complete
+        # checkpoint
+        tmp = path + '.state.tmp.npz'
+        np.savez(tmp, **state)
+        os.replace(tmp, path + '.state.npz')
+        return path
+
+    def checkpoint_saver(self):
+        """The Saver, built on first use so that runs without checkpoints
+        add no ops; each run takes over the rotation of the checkpoints
+        already in its log directory."""
+        if self.saver is None:
+            self.saver = tf.train.Saver(
+                    max_to_keep=self.cfg['checkpoints_to_keep'])
+        if not self.checkpoints_recovered:
+            ckpt = tf.train.get_checkpoint_state(self.checkpoint_dir)
+            self.saver.recover_last_checkpoints(
+                    [] if ckpt is None else ckpt.all_model_checkpoint_paths)
+            self.checkpoints_recovered = True
+        return self.saver
 
-                if verbose:
-                    # TODO Fix this redundancy
-                    loss = self.sess.run(
-                            self.loss,
-                            feed_dict=train_fd_use_argmax
-                            )
-                    print(f"superepoch {i // self.cfg['superepoch']}\t"
-                          f"training loss: {loss.mean():.3f}")
+    @staticmethod
+    def latest_checkpoint(checkpoint_dir):
+        """Path of the newest complete checkpoint in `checkpoint_dir`, or
+        None."""
+        ckpt = tf.train.get_checkpoint_state(checkpoint_dir)
+        if ckpt is None:
+            return None
+        for path in reversed(ckpt.all_model_checkpoint_paths):
+            if os.path.exists(path + '.state.npz'):
+                return path
+        return None
+
+    def restore_checkpoint(self):
+        """Continue from the latest checkpoint in the log directory. Returns
+        False if there is none."""
+        path = Binary.latest_checkpoint(self.checkpoint_dir)
+        if path is None:
+            return False
+        self.checkpoint_saver().restore(self.sess, path)
+        with np.load(path + '.state.npz') as state:
+            self.start_epoch = int(state['epoch'])
+            self.train_fd[self.temperature.name] = float(state['temperature'])
+            if 'train_data' in state:
+                self.train_fd[self.e_inputs.name] = state['train_data']
+                self.test_fd[self.e_inputs.name] = state['test_data']
+            if 'train_weights' in state:
+                self.train_fd[self.example_weights.name] = (
+                        state['train_weights'])
+        return True
+
+    def warm_start(self, path):
+        """Initialize the model variables from a checkpoint of another run,
+        which may differ in shape-determining config such as sentence_len or
+        num_concepts: the leading block shared by the old and new shape is
+        copied and the rest keeps its fresh initialization. The optimizer
+        state and the temperature start fresh."""
+        if os.path.isdir(path):
+            checkpoint = Binary.latest_checkpoint(path)
+            if checkpoint is None:
+                raise ValueError(f"no checkpoint to warm-start from in {path}")
+            path = checkpoint
+        reader = tf.train.NewCheckpointReader(path)
+        saved = reader.get_variable_to_shape_map()
+        skip = set(self.optimizer.variables()) | {self.temp_var}
+        for var in tf.global_variables():
+            name = var.op.name
+            if var in skip or name not in saved:
+                continue
+            old = reader.get_tensor(name)
+            new = self.sess.run(var)
+            if old.ndim != new.ndim:
+                continue
+            if old.ndim == 0:
+                var.load(old, self.sess)
+                continue
+            block = tuple(slice(0, min(a, b))
+                    for a, b in zip(old.shape, new.shape))
+            new[block] = old[block]
+            var.load(new, self.sess)
+
+    def write_summaries(self, superepoch, verbose=False):
+        """Evaluate both splits with the argmax channel, one forward pass
+        each, record their summaries every `summary_every` superepochs and
+        return the loss, accuracy and utterances of each split."""
+        fetches = {
+            'loss': self.mean_loss,
+            'accuracy': self.accuracy,
+            'tokens': self.tokens,
+        }
+        train_fd_use_argmax = {
+                **self.train_fd,
+                self.use_argmax.name: True
+                }
+        train = self.sess.run(fetches, feed_dict=train_fd_use_argmax)
+        test = self.sess.run(fetches, feed_dict=self.test_fd)
+        if superepoch % self.cfg['summary_every'] == 0:
+            for split, values in [('train', train), ('test', test)]:
+                self.summaries.scalars(split, superepoch, {
+                    'loss': values['loss'],
+                    'accuracy': values['accuracy'],
+                    })
+
+        if verbose:
+            print(f"superepoch {superepoch}\t"
+                  f"training loss: {train['loss']:.3f}")
+        self.metrics = {'train': train, 'test': test}
+        return self.metrics
 
     def train(self, inputs, labels=None, verbose=False):
         # The labels are unused because they are the same as the input
@@ -293,22 +728,22 @@ class Binary:
             self.straight_through.name: self.cfg['train_st'],
             self.dropout_rate.name: self.cfg['dropout_rate'],
             self.use_argmax.name: False,
+            self.learning_rate.name: self.cfg['learning_rate'],
         }
 
         for i in range(self.cfg['epochs']):
+            if self.cfg['seed'] is not None:
+                train_fd[self.noise_seed.name] = (self.cfg['seed'], i)
             self.sess.run(self.train_step, feed_dict=train_fd)
             if i % self.cfg['superepoch'] == 0:
                 train_fd[self.temperature.name] *= self.cfg['temp_decay']
                 if verbose:
-                    summary = self.sess.run(self.summary, feed_dict=train_fd)
-                    self.file_writer.add_summary(
-                            summary,
-                            i // self.cfg['superepoch']
-                            )
-                    # TODO Fix this redundancy
-                    loss = self.sess.run(self.loss, feed_dict=train_fd)
+                    loss = self.sess.run(self.mean_loss, feed_dict=train_fd)
+                    self.summaries.scalars('train',
+                            i // self.cfg['superepoch'], {'loss': loss})
                     print(f"superepoch {i // self.cfg['superepoch']}\t"
-                          f"training loss: {loss.mean():.3f}")
+                          f"training loss: {loss:.3f}")
+        self.summaries.flush()
 
     def test(self, verbose=False):
         # The labels are unused because they are the same as the input
@@ -318,35 +753,120 @@ class Binary:
             print(f"test loss\t"
                   f"avg: {np.average(losses):.3f}\t"
                   f"max: {np.max(losses):.3f}")
+        return np.average(losses), np.max(losses)
+
+    def get_weights(self):
+        """Return the values of all model variables (not the optimizer's)
+        keyed by variable name."""
+        optimizer_vars = set(self.optimizer.variables())
+        variables = [v for v in tf.global_variables()
+                if v not in optimizer_vars]
+        return dict(zip([v.name for v in variables],
+            self.sess.run(variables)))
+
+    def freeze(self, path=None):
+        """Return the argmax encoder and the decoder as a
+        `frozen.FrozenBinary`, also saving it to `path` if given."""
+        h0, word = self.encoder_layers[:2]
+        _, bn, output, cls = self.decoder_layers
+        w = self.sess.run({
+            'embeddings': self.e_embeddings_w,
+            'encoder_h0_w': h0.kernel,
+            'encoder_h0_b': h0.bias,
+            'encoder_word_w': word.kernel,
+            'encoder_word_b': word.bias,
+            'd_fc_w': self.d_fc_w[0],
+            'd_fc_b': self.d_fc_b[:, 0],
+            'gamma': bn.gamma,
+            'beta': bn.beta,
+            'mean': bn.moving_mean,
+            'variance': bn.moving_variance,
+            'decoder_output_w': output.kernel,
+            'decoder_output_b': output.bias,
+            'decoder_class_w': cls.kernel,
+            'decoder_class_b': cls.bias,
+        })
+        w['bn_scale'], w['bn_shift'] = frozen.fold_batch_norm(w.pop('gamma'),
+                w.pop('beta'), w.pop('mean'), w.pop('variance'), bn.epsilon)
+        pair = frozen.FrozenBinary(w, self.cfg['num_concepts'],
+                self.cfg['sentence_len'], self.cfg['vocab_size'])
+        if path is not None:
+            pair.save(path)
+        return pair
+
+    def lexicon(self, chunk_size=2**12):
+        """Return the argmax utterance for every input in `permutations`
+        order as a (2**num_concepts, sentence_len) token array."""
+        fd = dict(self.test_fd)
+        tokens = []
+        chunks = Binary.permutation_chunks(self.cfg['num_concepts'], chunk_size)
+        for inputs in chunks:
+            fd[self.e_inputs.name] = inputs
+            tokens.append(self.sess.run(self.tokens, feed_dict=fd))
+        return np.concatenate(tokens).astype(np.uint8)
+
+    def decode_tokens(self, tokens, chunk_size=2**12):
+        """Return the decoder's sigmoid output for each utterance in a
+        (batch, sentence_len) token array."""
+        results = [self.sess.run(self.decoded,
+            feed_dict={self.utt_tokens.name: tokens[i:i + chunk_size]})
+            for i in range(0, len(tokens), chunk_size)]
+        return np.concatenate(results) if results else np.zeros(
+                (0, self.cfg['num_concepts']), dtype=np.float32)
+
+    def output_test_space(self, verbose=False, chunk_size=2**12):
+        fd = dict(self.train_fd)
+        chunks = Binary.permutation_chunks(self.cfg['num_concepts'], chunk_size)
+        for inputs in chunks:
+            fd[self.e_inputs.name] = inputs
+            results, utterances = self.sess.run(
+                    [self.d_sigmoid, self.utterance], feed_dict=fd)
+            sents = util.ohvs_to_words(utterances)
+            for i in range(len(inputs)):
+                print(f'{inputs[i]} -> {sents[i]} -> {results[i]}')
+
+class BinaryHandle:
+    """Hands out a Binary model for each run, building the graph and
+    session only when the graph keys change and otherwise resetting the
+    previous model."""
+
+    def __init__(self):
+        self.model = None
+
+    def get(self, cfg=None, logdir='log'):
+        cfg = cfg or {}
+        if cfg.get('backend') == 'numpy':
+            return Binary(cfg, logdir)
+        cfg = {**Binary.default_cfg, **cfg}
+        if (self.model is not None
+                and Binary.graph_key(self.model.cfg) == Binary.graph_key(cfg)):
+            self.model.reset(cfg, logdir)
+            return self.model
+        self.close()
+        self.model = Binary(cfg, logdir)
+        return self.model
+
+    def close(self):
+        if self.model is not None:
+            self.model.close()
+            self.model = None
+            tf.reset_default_graph()
 
-    def output_test_space(self, verbose=False):
-        # Not yet implemented
-        inputs = Binary.permutations(self.cfg['num_concepts'])
-        fd = {**self.train_fd, self.e_inputs.name: inputs}
-        results = self.sess.run(self.d_sigmoid, feed_dict=fd)
-        utterances = self.sess.run(self.utterance, feed_dict=fd)
-        for i in range(2**self.cfg['num_concepts']):
-            sent = util.ohvs_to_words(utterances[i])
-            print(f'{inputs[i]} -> {sent} -> {results[i]}')
 
 if __name__ == '__main__':
     np.set_printoptions(formatter={'float': lambda x: "{0:0.2f}".format(x)})
     cfg = {
         'epochs': 1000,
-        'verbose': True,
         'dropout_rate': 0.2,
-        'print_all_sentences': False,
     }
-    results = []
-    #for i in range(3):
+    # Runs with the same graph keys reuse one graph and session
+    handle = BinaryHandle()
     try:
-        while True:
-            ap = Binary(cfg)
-            writer = tf.summary.FileWriter('log', ap.sess.graph)
-            results.append(ap.interactive_run())
-            writer.close()
-            exit(0)
-            tf.reset_default_graph()
+        for seed in range(3):
+            ap = handle.get({**cfg, 'seed': seed}, f'log/seed{seed}')
+            ap.run(verbose=True)
+            ap.test(verbose=True)
     except KeyboardInterrupt:
         pass
-
+    finally:
+        handle.close()
@@ -0,0 +1,452 @@
+import glob
+import os
+import re
+import time
+
+import numpy as np
+
+from .. import frozen, space, summaries, util
+from ..defaults import NUMPY_BINARY_CFG
+from ..schedule import EarlyStopping
+
+# The decoder's batch renorm layer only ever runs in inference mode with its
+# initial moving statistics, so it reduces to this scale followed by a
+# trainable scale and shift
+BN_SCALE = 1 / np.sqrt(1 + 1e-3)
+
+# Config of the TensorFlow model which changes what a run computes or writes
+# and which the NumPy engine only supports with these values; performance
+# settings such as steps_per_call, decoder and the thread counts do not
+# apply to it
+SUPPORTED_ONLY = {
+    'data_mode': 'enumerate',
+    'profile_steps': [],
+}
+
+
+def truncated_normal(rng, stddev, shape):
+    """Normal samples redrawn until they lie within two standard deviations,
+    as tf.initializers.truncated_normal does."""
+    x = rng.normal(0, 1, shape)
+    bad = np.abs(x) > 2
+    while bad.any():
+        x[bad] = rng.normal(0, 1, bad.sum())
+        bad = np.abs(x) > 2
+    return x * stddev
+
+
+def glorot_uniform(rng, fan_in, fan_out):
+    limit = np.sqrt(6 / (fan_in + fan_out))
+    return rng.uniform(-limit, limit, (fan_in, fan_out))
+
+
+def softmax(x):
+    e = np.exp(x - x.max(axis=-1, keepdims=True))
+    return e / e.sum(axis=-1, keepdims=True)
+
+
+def one_hot(indexes, size):
+    return np.eye(size)[indexes]
+
+
+def sigmoid_cross_entropy(logits, labels):
+    """Elementwise, in the same numerically stable form as
+    tf.nn.sigmoid_cross_entropy_with_logits."""
+    return (np.maximum(logits, 0) - logits * labels
+            + np.log1p(np.exp(-np.abs(logits))))
+
+
+class NumpyBinary:
+    """The Binary architecture trained in vectorized NumPy with hand-written
+    gradients and Adam. For tiny configurations this avoids the per-step
+    session dispatch which dominates the TensorFlow model's run time."""
+
+    # Adam hyperparameters, matching tf.train.AdamOptimizer's defaults
+    beta1 = 0.9
+    beta2 = 0.999
+    epsilon = 1e-8
+
+    def __init__(self, cfg=None, logdir='log'):
+        if cfg is None:
+            self.cfg = NUMPY_BINARY_CFG
+        else:
+            self.cfg = {**NUMPY_BINARY_CFG, **cfg}
+        for k, value in SUPPORTED_ONLY.items():
+            if self.cfg[k] != value:
+                raise ValueError(f"the numpy backend does not support "
+                        f"{k}={self.cfg[k]!r}")
+        self.logdir = logdir
+        self.rng = np.random.RandomState(self.cfg['seed'])
+        self.initialize_params()
+        self.generate_train_and_test()
+        self.temperature = self.cfg['temp_init']
+        self.history = []
+        self.summaries = summaries.make_sink(self.cfg, logdir)
+        self.checkpoint_dir = os.path.join(logdir, 'checkpoints')
+        self.start_epoch = 0
+        if self.cfg['warm_start'] is not None:
+            self.warm_start(self.cfg['warm_start'])
+        if self.cfg['resume']:
+            self.restore_checkpoint()
+
+    def close(self):
+        self.summaries.close()
+
+    def initialize_params(self):
+        cfg = self.cfg
+        rng = self.rng
+        vocab_size, sentence_len = cfg['vocab_size'], cfg['sentence_len']
+        flat_size = sentence_len * cfg['d_dense_size']
+        # Not trained
+        self.e_embeddings_w = truncated_normal(rng, 1e0,
+                (cfg['num_concepts'], cfg['input_dim']))
+        self.params = {
+            'encoder_h0_w': glorot_uniform(rng, cfg['input_dim'],
+                cfg['e_dense_size']),
+            'encoder_h0_b': np.zeros(cfg['e_dense_size']),
+            'encoder_word_w': glorot_uniform(rng, cfg['e_dense_size'],
+                vocab_size * sentence_len),
+            'encoder_word_b': np.zeros(vocab_size * sentence_len),
+            'd_fc_w': truncated_normal(rng, 1e-2,
+                (vocab_size, cfg['d_dense_size'])),
+            'd_fc_b': np.full((sentence_len, cfg['d_dense_size']), 1e-1),
+            'bn_gamma': np.ones(flat_size),
+            'bn_beta': np.zeros(flat_size),
+            'decoder_output_w': glorot_uniform(rng, flat_size,
+                cfg['input_dim']),
+            'decoder_output_b': np.zeros(cfg['input_dim']),
+            'decoder_class_w': glorot_uniform(rng, cfg['input_dim'],
+                cfg['num_concepts']),
+            'decoder_class_b': np.zeros(cfg['num_concepts']),
+        }
+        self.adam_m = {k: np.zeros_like(v) for k, v in self.params.items()}
+        self.adam_v = {k: np.zeros_like(v) for k, v in self.params.items()}
+        self.adam_t = 0
+
+    def generate_train_and_test(self):
+        all_input = space.permutations(self.cfg['num_concepts'])
+        train_i, test_i = space.train_test_split(
+                all_input,
+                self.cfg['test_prop'],
+                seed=self.cfg['seed'],
+                )
+        if self.cfg['weighted_examples']:
+            self.train_weights = np.full(len(train_i), self.cfg['batch_size'],
+                    dtype=np.float64)
+        else:
+            train_i = np.repeat(train_i, self.cfg['batch_size'], axis=0)
+            self.train_weights = np.ones(len(train_i))
+        self.rng.shuffle(train_i)
+        self.train_data = all_input[train_i].astype(np.float64)
+        self.test_data = all_input[test_i].astype(np.float64)
+
+    def forward(self, inputs, use_argmax, temperature=None):
+        """Return the decoder logits and the intermediate values needed by
+        `backward`."""
+        p = self.params
+        cfg = self.cfg
+        batch_size = len(inputs)
+        sentence_len, vocab_size = cfg['sentence_len'], cfg['vocab_size']
+
+        emb = inputs @ self.e_embeddings_w
+        h_pre = emb @ p['encoder_h0_w'] + p['encoder_h0_b']
+        h = np.maximum(h_pre, 0)
+        logits = (h @ p['encoder_word_w'] + p['encoder_word_b']).reshape(
+                batch_size, sentence_len, vocab_size)
+
+        sample = None
+        mask = 1.
+        if use_argmax:
+            utterance = one_hot(logits.argmax(-1), vocab_size)
+        else:
+            uniform = self.rng.uniform(np.finfo(np.float64).tiny, 1.,
+                    logits.shape)
+            gumbel = -np.log(-np.log(uniform))
+            sample = softmax((logits + gumbel) / temperature)
+            if cfg['train_st']:
+                utterance = one_hot(sample.argmax(-1), vocab_size)
+            else:
+                utterance = sample
+            keep = 1 - cfg['dropout_rate']
+            if keep < 1:
+                mask = np.floor(keep + self.rng.uniform(
+                    size=(batch_size, sentence_len, 1))) / keep
+        utt_dropout = utterance * mask
+
+        d_output, cache = self.decoder_forward(utt_dropout)
+        cache.update({
+            'emb': emb, 'h_pre': h_pre, 'h': h, 'sample': sample,
+            'mask': mask, 'utterance': utterance, 'utt_dropout': utt_dropout,
+            'temperature': temperature,
+        })
+        return d_output, cache
+
+    def decoder_forward(self, utt_dropout):
+        p = self.params
+        d_pre = utt_dropout @ p['d_fc_w'] + p['d_fc_b']
+        d = np.maximum(d_pre, 0).reshape(len(utt_dropout), -1)
+        bn = d * BN_SCALE * p['bn_gamma'] + p['bn_beta']
+        o = bn @ p['decoder_output_w'] + p['decoder_output_b']
+        d_output = o @ p['decoder_class_w'] + p['decoder_class_b']
+        return d_output, {'d_pre': d_pre, 'd': d, 'bn': bn, 'o': o}
+
+    def backward(self, inputs, weights, d_output, cache):
+        """Gradients of the weighted, summed sigmoid cross-entropy."""
+        p = self.params
+        c = cache
+        grads = {}
+
+        dout = (1 / (1 + np.exp(-d_output)) - inputs) * weights[:, None]
+        grads['decoder_class_w'] = c['o'].T @ dout
+        grads['decoder_class_b'] = dout.sum(0)
+        do = dout @ p['decoder_class_w'].T
+        grads['decoder_output_w'] = c['bn'].T @ do
+        grads['decoder_output_b'] = do.sum(0)
+        dbn = do @ p['decoder_output_w'].T
+        grads['bn_gamma'] = (dbn * c['d'] * BN_SCALE).sum(0)
+        grads['bn_beta'] = dbn.sum(0)
+        dd = (dbn * p['bn_gamma'] * BN_SCALE).reshape(c['d_pre'].shape)
+        dd = dd * (c['d_pre'] > 0)
+        grads['d_fc_w'] = np.einsum('blv,bld->vd', c['utt_dropout'], dd)
+        grads['d_fc_b'] = dd.sum(0)
+        dutt = (dd @ p['d_fc_w'].T) * c['mask']
+
+        if self.cfg['train_st']:
+            # The straight-through gradient goes to the logits unchanged
+            dlogits = dutt
+        else:
+            s = c['sample']
+            dlogits = s * (dutt - (dutt * s).sum(-1, keepdims=True))
+            dlogits = dlogits / c['temperature']
+        dz = dlogits.reshape(len(inputs), -1)
+        grads['encoder_word_w'] = c['h'].T @ dz
+        grads['encoder_word_b'] = dz.sum(0)
+        dh = (dz @ p['encoder_word_w'].T) * (c['h_pre'] > 0)
+        grads['encoder_h0_w'] = c['emb'].T @ dh
+        grads['encoder_h0_b'] = dh.sum(0)
+        return grads
+
+    def apply_adam(self, grads):
+        self.adam_t += 1
+        t = self.adam_t
+        lr = (self.cfg['learning_rate'] * np.sqrt(1 - self.beta2**t)
+                / (1 - self.beta1**t))
+        for k, g in grads.items():
+            m, v = self.adam_m[k], self.adam_v[k]
+            m *= self.beta1
+            m += (1 - self.beta1) * g
+            v *= self.beta2
+            v += (1 - self.beta2) * g * g
+            self.params[k] -= lr * m / (np.sqrt(v) + self.epsilon)
+
+    def train_step(self):
+        d_output, cache = self.forward(self.train_data, False,
+                self.temperature)
+        grads = self.backward(self.train_data, self.train_weights, d_output,
+                cache)
+        self.apply_adam(grads)
+
+    def loss(self, inputs):
+        """Elementwise loss of the argmax channel."""
+        d_output, _ = self.forward(inputs, True)
+        return sigmoid_cross_entropy(d_output, inputs)
+
+    def run(self, verbose=False):
+        start = time.perf_counter()
+        stopping = (EarlyStopping(self.cfg)
+                if self.cfg['early_stopping'] else None)
+        self.epochs_run = self.cfg['epochs']
+        for i in range(self.start_epoch, self.cfg['epochs']):
+            self.train_step()
+            if i % self.cfg['superepoch'] == 0:
+                self.temperature *= self.cfg['temp_decay']
+                superepoch = i // self.cfg['superepoch']
+                train_loss, train_accuracy = self.evaluate(self.train_data)
+                test_loss, test_accuracy = self.evaluate(self.test_data)
+                self.history.append((superepoch, train_loss, test_loss))
+                if superepoch % self.cfg['summary_every'] == 0:
+                    self.summaries.scalars('train', superepoch,
+                            {'loss': train_loss, 'accuracy': train_accuracy})
+                    self.summaries.scalars('test', superepoch,
+                            {'loss': test_loss, 'accuracy': test_accuracy})
+                if verbose:
+                    print(f"superepoch {superepoch}\t"
+                          f"training loss: {train_loss:.3f}")
+                if stopping is not None:
+                    if stopping.update(train_loss, train_accuracy):
+                        self.epochs_run = i + 1
+                        break
+                every = self.cfg['checkpoint_every']
+                if every and superepoch % every == 0:
+                    self.save_checkpoint(i + 1)
+        elapsed = time.perf_counter() - start
+        if self.cfg['checkpoint_every']:
+            self.save_checkpoint(self.epochs_run)
+        self.summaries.flush()
+        steps = self.epochs_run - self.start_epoch
+        self.steps_per_sec = steps / elapsed if elapsed else 0.
+        self.epochs_saved = self.cfg['epochs'] - self.epochs_run
+        if verbose:
+            if self.epochs_saved:
+                print(f"stopped early ({stopping.reason}) after "
+                      f"{self.epochs_run} epochs, "
+                      f"saving {self.epochs_saved}")
+            print(f"{self.steps_per_sec:.1f} steps/sec")
+
+    def evaluate(self, inputs):
+        """Mean loss and accuracy (fraction of inputs reconstructed
+        exactly) of the argmax channel."""
+        losses = self.loss(inputs)
+        # The loss is below log(2) for a bit exactly when the logit has the
+        # right sign
+        return losses.mean(), (losses < np.log(2)).all(-1).mean()
+
+    def save_checkpoint(self, epoch):
+        """Save the parameters, the Adam state, the temperature, the random
+        state, the history and the train/test split after `epoch` completed
+        epochs, keeping the newest `checkpoints_to_keep`."""
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        _, keys, pos, has_gauss, gauss = self.rng.get_state()
+        arrays = {
+            'epoch': epoch,
+            'e_embeddings_w': self.e_embeddings_w,
+            'adam_t': self.adam_t,
+            'temperature': self.temperature,
+            'rng_keys': keys,
+            'rng_pos': pos,
+            'rng_has_gauss': has_gauss,
+            'rng_gauss': gauss,
+            'history': np.array(self.history).reshape(-1, 3),
+            'train_data': self.train_data,
+            'test_data': self.test_data,
+            'train_weights': self.train_weights,
+        }
+        for k in self.params:
+            arrays['params/' + k] = self.params[k]
+            arrays['adam_m/' + k] = self.adam_m[k]
+            arrays['adam_v/' + k] = self.adam_v[k]
+        path = os.path.join(self.checkpoint_dir, f'model-{epoch}.npz')
+        tmp = path + '.tmp.npz'
+        np.savez(tmp, **arrays)
+        os.replace(tmp, path)
+        for old in NumpyBinary.checkpoints(self.checkpoint_dir)[
+                :-self.cfg['checkpoints_to_keep']]:
+            os.remove(old)
+        return path
+
+    @staticmethod
+    def checkpoints(checkpoint_dir):
+        """Paths of the checkpoints in `checkpoint_dir`, oldest first."""
+        epochs = {}
+        for path in glob.glob(os.path.join(checkpoint_dir, 'model-*.npz')):
+            match = re.fullmatch(r'model-(\d+)\.npz', os.path.basename(path))
+            if match:
+                epochs[path] = int(match.group(1))
+        return sorted(epochs, key=epochs.get)
+
+    @staticmethod
+    def latest_checkpoint(checkpoint_dir):
+        paths = NumpyBinary.checkpoints(checkpoint_dir)
+        return paths[-1] if paths else None
+
+    def restore_checkpoint(self):
+        """Continue from the latest checkpoint in the log directory. Returns
+        False if there is none."""
+        path = NumpyBinary.latest_checkpoint(self.checkpoint_dir)
+        if path is None:
+            return False
+        with np.load(path) as state:
+            self.start_epoch = int(state['epoch'])
+            self.e_embeddings_w = state['e_embeddings_w']
+            for k in self.params:
+                self.params[k] = state['params/' + k]
+                self.adam_m[k] = state['adam_m/' + k]
+                self.adam_v[k] = state['adam_v/' + k]
+            self.adam_t = int(state['adam_t'])
+            self.temperature = float(state['temperature'])
+            self.rng.set_state(('MT19937', state['rng_keys'],
+                int(state['rng_pos']), int(state['rng_has_gauss']),
+                float(state['rng_gauss'])))
+            self.history = [(int(s), train, test)
+                    for s, train, test in state['history']]
+            self.train_data = state['train_data']
+            self.test_data = state['test_data']
+            self.train_weights = state['train_weights']
+        return True
+
+    def warm_start(self, path):
+        """Initialize the parameters from a checkpoint of another NumPy run,
+        which may differ in shape-determining config: the leading block
+        shared by the old and new shape is copied. The Adam state and the
+        temperature start fresh."""
+        if os.path.isdir(path):
+            checkpoint = NumpyBinary.latest_checkpoint(path)
+            if checkpoint is None:
+                raise ValueError(f"no checkpoint to warm-start from in {path}")
+            path = checkpoint
+        with np.load(path) as state:
+            targets = {'e_embeddings_w': self.e_embeddings_w,
+                    **{'params/' + k: v for k, v in self.params.items()}}
+            for name, new in targets.items():
+                if name not in state.files or state[name].ndim != new.ndim:
+                    continue
+                old = state[name]
+                block = tuple(slice(0, min(a, b))
+                        for a, b in zip(old.shape, new.shape))
+                new[block] = old[block]
+
+    def test(self, verbose=False):
+        losses = self.loss(self.test_data).mean(axis=-1)
+        if verbose:
+            print(f"test loss\t"
+                  f"avg: {np.average(losses):.3f}\t"
+                  f"max: {np.max(losses):.3f}")
+        return np.average(losses), np.max(losses)
+
+    def get_weights(self):
+        return {'e_embeddings_w': self.e_embeddings_w, **self.params}
+
+    def freeze(self, path=None):
+        """Return the argmax encoder and the decoder as a
+        `frozen.FrozenBinary`, also saving it to `path` if given."""
+        p = self.params
+        w = {k: v for k, v in p.items() if not k.startswith('bn_')}
+        w['embeddings'] = self.e_embeddings_w
+        w['bn_scale'] = BN_SCALE * p['bn_gamma']
+        w['bn_shift'] = p['bn_beta']
+        pair = frozen.FrozenBinary(w, self.cfg['num_concepts'],
+                self.cfg['sentence_len'], self.cfg['vocab_size'])
+        if path is not None:
+            pair.save(path)
+        return pair
+
+    def lexicon(self, chunk_size=2**12):
+        """Return the argmax utterance for every input in `permutations`
+        order as a (2**num_concepts, sentence_len) token array."""
+        tokens = []
+        chunks = space.permutation_chunks(self.cfg['num_concepts'], chunk_size)
+        for inputs in chunks:
+            _, cache = self.forward(inputs.astype(np.float64), True)
+            tokens.append(cache['utterance'].argmax(-1))
+        return np.concatenate(tokens).astype(np.uint8)
+
+    def decode_tokens(self, tokens, chunk_size=2**12):
+        """Return the decoder's sigmoid output for each utterance in a
+        (batch, sentence_len) token array."""
+        results = []
+        for i in range(0, len(tokens), chunk_size):
+            d_output, _ = self.decoder_forward(
+                    one_hot(tokens[i:i + chunk_size], self.cfg['vocab_size']))
+            results.append(1 / (1 + np.exp(-d_output)))
+        return np.concatenate(results) if results else np.zeros(
+                (0, self.cfg['num_concepts']))
+
+    def output_test_space(self, verbose=False, chunk_size=2**12):
+        chunks = space.permutation_chunks(self.cfg['num_concepts'], chunk_size)
+        for inputs in chunks:
+            d_output, cache = self.forward(inputs.astype(np.float64), False,
+                    self.temperature)
+            results = 1 / (1 + np.exp(-d_output))
+            sents = util.ohvs_to_words(cache['utterance'])
+            for i in range(len(inputs)):
+                print(f'{inputs[i]} -> {sents[i]} -> {results[i]}')
@@ -7,9 +7,10 @@ from tensorflow.keras.layers import (Dense, Dropout, Input, Concatenate,
 from tensorflow.keras.initializers import RandomNormal
 import tensorflow_probability as tfp
 
+from .. import frozen
+from ..profiling import StepProfiler
+
 ROHC = tfp.distributions.RelaxedOneHotCategorical
-np.set_printoptions(precision=2, sign=' ')
-#np.set_printoptions(formatter={'float': lambda x: "{0:0.3f}".format(x)})
 
 
 def sampler(logits, temp, size, straight_through):
@@ -26,83 +27,162 @@ def sampler(logits, temp, size, straight_through):
 
 class OneHot:
 
-    def __init__(self, cfg):
+    # Config which determines the graph; `reset` accepts any other change
+    graph_keys = ['num_concepts', 'input_dim', 'e_dense_size',
+            'd_dense_size', 'sentence_len', 'vocab_size']
+
+    def __init__(self, cfg, logdir='log'):
         self.cfg = cfg
-        self.sess = tf.Session()
+        self.sess = tf.Session(config=tf.ConfigProto(
+            intra_op_parallelism_threads=cfg.get('intra_op_threads', 0),
+            inter_op_parallelism_threads=cfg.get('inter_op_threads', 0),
+            ))
 
         # Encoder inputs
         e_inputs = Input(shape=(cfg['num_concepts'],), name='e_oh')
         e_temp = Input(shape=(1,), dtype='float32', name='e_temp')
         e_st = Input(shape=(1,), dtype='bool', name='e_st')
-
-        # Generate a static vector space of "concepts"
-        e_x = Dense(cfg['input_dim'],
-                trainable=False,
-                kernel_initializer=RandomNormal(),
-                use_bias=False,
-                name='concept_space',)(e_inputs)
-
-        # Dense layer for encocder
-        e_x = Dense(cfg['e_dense_size'],
-                activation='relu',
-                name='encoder_h0')(e_x)
-        e_x = tf.layers.batch_normalization(e_x, renorm=True)
-        # The generic keras BN was NaN'ing, but tf.keras might be okay
-        #e_x = BatchNormalization()(e_x)
-        e_x = Dense(cfg['vocab_size']*cfg['sentence_len'],
-                name="encoder_word_dense")(e_x)
-        e_x = tf.keras.layers.Reshape((cfg['sentence_len'],
-                cfg['vocab_size']))(e_x)
-
-        # Generate GS sampling layer
-        categorical = lambda x: (
-            sampler(x, e_temp, cfg['vocab_size'], e_st))
-        self.e_output = Lambda(categorical)(e_x)
-
-        
-        # Decoder input
-        d_x = Flatten(name='decoder_flatten')(self.e_output)
-        d_x = Dense(cfg['d_dense_size'],
-                activation='relu',
-                name='decoder_input')(d_x)
-        #d_x1 = BatchNormalization()(d_x0)
-        d_x = tf.layers.batch_normalization(d_x, renorm=True)
-
-        d_x = Dense(cfg['input_dim'], activation=None,
-                name='decoder_output')(d_x)
-        d_output = Dense(cfg['num_concepts'],
-                name="decoder_class",
-                activation=None,)(d_x)
-        self.d_softmax = tf.nn.softmax(d_output)
-
-        e_inputs = tf.stop_gradient(e_inputs)
-        optmizier = tf.train.AdamOptimizer()
-        self.loss = tf.nn.sparse_softmax_cross_entropy_with_logits(
-                logits=d_output, labels=tf.argmax(e_inputs, axis=-1))
-
-        self.train = optmizier.minimize(self.loss)
-
-        train_input = np.random.permutation(np.repeat(
-            np.identity(cfg['num_concepts']), cfg['batch_size'], axis=0))
+        # Per-example loss weights, used in place of repeating examples
+        e_weight = tf.placeholder_with_default(
+                tf.ones(tf.shape(e_inputs)[:1]),
+                shape=(None,), name='e_weight')
+        self.e_inputs = e_inputs
+        self.e_temp = e_temp
+        self.e_st = e_st
+        self.e_weight = e_weight
+
+        # Layers with weights, kept for `freeze`
+        self.layers = {}
+        with tf.name_scope("encoder"):
+            # Generate a static vector space of "concepts"
+            self.layers['concept_space'] = Dense(cfg['input_dim'],
+                    trainable=False,
+                    kernel_initializer=RandomNormal(),
+                    use_bias=False,
+                    name='concept_space',)
+            e_x = self.layers['concept_space'](e_inputs)
+
+            # Dense layer for encocder
+            self.layers['encoder_h0'] = Dense(cfg['e_dense_size'],
+                    activation='relu',
+                    name='encoder_h0')
+            e_x = self.layers['encoder_h0'](e_x)
+            # Equivalent to tf.layers.batch_normalization(e_x, renorm=True)
+            self.layers['encoder_bn'] = tf.layers.BatchNormalization(
+                    renorm=True)
+            e_x = self.layers['encoder_bn'](e_x)
+            # The generic keras BN was NaN'ing, but tf.keras might be okay
+            #e_x = BatchNormalization()(e_x)
+            self.layers['encoder_word'] = Dense(
+                    cfg['vocab_size']*cfg['sentence_len'],
+                    name="encoder_word_dense")
+            e_x = self.layers['encoder_word'](e_x)
+            e_x = tf.keras.layers.Reshape((cfg['sentence_len'],
+                    cfg['vocab_size']))(e_x)
+
+        with tf.name_scope("communication"):
+            # Generate GS sampling layer
+            categorical = lambda x: (
+                sampler(x, e_temp, cfg['vocab_size'], e_st))
+            self.e_output = Lambda(categorical)(e_x)
+
+        with tf.name_scope("decoder"):
+            # Decoder input
+            d_x = Flatten(name='decoder_flatten')(self.e_output)
+            self.layers['decoder_input'] = Dense(cfg['d_dense_size'],
+                    activation='relu',
+                    name='decoder_input')
+            d_x = self.layers['decoder_input'](d_x)
+            #d_x1 = BatchNormalization()(d_x0)
+            self.layers['decoder_bn'] = tf.layers.BatchNormalization(
+                    renorm=True)
+            d_x = self.layers['decoder_bn'](d_x)
+
+            self.layers['decoder_output'] = Dense(cfg['input_dim'],
+                    activation=None,
+                    name='decoder_output')
+            d_x = self.layers['decoder_output'](d_x)
+            self.layers['decoder_class'] = Dense(cfg['num_concepts'],
+                    name="decoder_class",
+                    activation=None,)
+            d_output = self.layers['decoder_class'](d_x)
+            self.d_softmax = tf.nn.softmax(d_output)
+
+        with tf.name_scope("training"):
+            e_inputs = tf.stop_gradient(e_inputs)
+            optmizier = tf.train.AdamOptimizer()
+            self.loss = tf.nn.sparse_softmax_cross_entropy_with_logits(
+                    logits=d_output, labels=tf.argmax(e_inputs, axis=-1))
+            self.train = optmizier.minimize(self.loss * e_weight)
+
+        self.init_op = tf.initializers.global_variables()
+        self.initialize_run(logdir)
+
+    def initialize_run(self, logdir):
+        """Set up the feeds and profiler of a run."""
+        cfg = self.cfg
+        self.profiler = None
+        if cfg.get('profile_steps'):
+            self.profiler = StepProfiler(cfg['profile_steps'], logdir)
 
         self.train_fd = {
-            'e_oh:0': train_input,
-            'e_temp:0': [[cfg['temp_init']]],
-            'e_st:0': [[cfg['train_st']]],
+            self.e_temp.name: [[cfg['temp_init']]],
+            self.e_st.name: [[cfg['train_st']]],
         }
+        if cfg.get('weighted_examples', False):
+            self.train_fd[self.e_inputs.name] = np.identity(cfg['num_concepts'])
+            self.train_fd[self.e_weight.name] = np.full(cfg['num_concepts'],
+                    cfg['batch_size'], dtype=np.float32)
+        else:
+            self.train_fd[self.e_inputs.name] = np.random.permutation(np.repeat(
+                np.identity(cfg['num_concepts']), cfg['batch_size'], axis=0))
 
         self.test_fd = {
-            'e_oh:0': np.identity(cfg['num_concepts']),
-            'e_temp:0': [[1e-8]],
-            'e_st:0': [[1]],
+            self.e_inputs.name: np.identity(cfg['num_concepts']),
+            self.e_temp.name: [[1e-8]],
+            self.e_st.name: [[1]],
         }
 
+    def reset(self, cfg, logdir='log'):
+        """Prepare a new run with `cfg` on the existing graph and session;
+        `run` reinitializes the variables."""
+        changed = [k for k in OneHot.graph_keys if cfg[k] != self.cfg[k]]
+        if changed:
+            raise ValueError(f"cannot reset with a different {changed}")
+        self.cfg = cfg
+        self.initialize_run(logdir)
+
+    def freeze(self, path=None):
+        """Return the argmax encoder and the decoder as a
+        `frozen.FrozenOneHot`, also saving it to `path` if given."""
+        fetches = {}
+        for name, layer in self.layers.items():
+            if name.endswith('_bn'):
+                fetches[name] = [layer.gamma, layer.beta, layer.moving_mean,
+                        layer.moving_variance]
+            else:
+                fetches[name + '_w'] = layer.kernel
+                if layer.use_bias:
+                    fetches[name + '_b'] = layer.bias
+        w = self.sess.run(fetches)
+        for name in ['encoder_bn', 'decoder_bn']:
+            w[name + '_scale'], w[name + '_shift'] = frozen.fold_batch_norm(
+                    *w.pop(name), self.layers[name].epsilon)
+        pair = frozen.FrozenOneHot(w, self.cfg['num_concepts'],
+                self.cfg['sentence_len'], self.cfg['vocab_size'])
+        if path is not None:
+            pair.save(path)
+        return pair
+
     def run(self):
-        self.sess.run(tf.initializers.global_variables())
+        self.sess.run(self.init_op)
         for i in range(self.cfg['epochs']):
-            self.sess.run(self.train, feed_dict=self.train_fd)
+            if self.profiler is not None and i in self.profiler:
+                self.profiler.run(self.sess, self.train, self.train_fd, i)
+            else:
+                self.sess.run(self.train, feed_dict=self.train_fd)
             if i % self.cfg['superepoch'] == 0:
-                self.train_fd['e_temp:0'][0][0] *= self.cfg['temp_decay']
+                self.train_fd[self.e_temp.name][0][0] *= self.cfg['temp_decay']
                 if self.cfg['verbose']:
                     pass
 
@@ -126,6 +206,13 @@ default_config = {
     'temp_init': 5,
     'temp_decay': 0.9,
     'train_st': 0,
+    # Weight each concept's loss by batch_size instead of repeating it
+    'weighted_examples': False,
+    # Epochs to trace with RunMetadata, written under logdir/profile
+    'profile_steps': [],
+    # Session thread pool sizes; 0 lets TensorFlow pick
+    'intra_op_threads': 0,
+    'inter_op_threads': 0,
     
     'verbose': False,
 }
@@ -133,7 +220,8 @@ default_config = {
 if __name__ == '__main__':
     np.set_printoptions(formatter={'float': lambda x: "{0:0.3f}".format(x)})
     cfg = default_config
+    # The graph is built once and reinitialized for every run
+    ap = OneHot(cfg)
     for _ in range(3):
-        ap = OneHot(cfg)
+        ap.reset(cfg)
         ap.run()
-        tf.reset_default_graph()
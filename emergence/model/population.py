@@ -0,0 +1,254 @@
+import numpy as np
+import tensorflow as tf
+from tensorflow_probability.python.distributions import RelaxedOneHotCategorical
+
+from .binary import Binary
+
+# tf.layers.BatchNormalization default; the decoder's batch renorm layer only
+# ever runs in inference mode, so it reduces to a scale and shift
+BN_EPSILON = 1e-3
+
+
+class Population:
+    """`population_size` independent Binary agent pairs trained in lockstep in
+    one graph. Every weight has a leading member dimension, so each step is a
+    handful of batched matmuls instead of one session call per seed."""
+
+    default_cfg = {
+        **Binary.default_cfg,
+        'population_size': 8,
+    }
+
+    def __init__(self, cfg=None, logdir='log'):
+        if cfg is None:
+            self.cfg = Population.default_cfg
+        else:
+            self.cfg = {**Population.default_cfg, **cfg}
+        self.sess = tf.Session(config=tf.ConfigProto(
+            intra_op_parallelism_threads=self.cfg['intra_op_threads'],
+            inter_op_parallelism_threads=self.cfg['inter_op_threads'],
+            ))
+        if self.cfg['seed'] is not None:
+            # Seeds the weight initializers and the Gumbel and dropout noise
+            tf.set_random_seed(self.cfg['seed'])
+        self.initialize_graph()
+        self.generate_train_and_test()
+        self.train_writer = tf.summary.FileWriter(logdir + '/train')
+        self.test_writer = tf.summary.FileWriter(logdir + '/test')
+
+    def dense_variable(self, fan_in, fan_out, name):
+        """Per-member kernel and bias initialized like a Keras Dense layer."""
+        limit = np.sqrt(6 / (fan_in + fan_out))
+        w = tf.Variable(tf.random_uniform(
+            (self.cfg['population_size'], fan_in, fan_out), -limit, limit),
+            name=name + '_w')
+        b = tf.Variable(tf.zeros((self.cfg['population_size'], 1, fan_out)),
+                name=name + '_b')
+        return w, b
+
+    def initialize_encoder(self):
+        cfg = self.cfg
+        self.e_inputs = tf.placeholder(tf.float32,
+                shape=(cfg['population_size'], None, cfg['num_concepts']),
+                name='e_input')
+        e_embeddings_w = tf.Variable(
+                tf.initializers.truncated_normal(0, 1e0)(
+                    (cfg['population_size'], cfg['num_concepts'],
+                        cfg['input_dim'])),
+                dtype=tf.float32,
+                trainable=False,
+                )
+        h0_w, h0_b = self.dense_variable(cfg['input_dim'],
+                cfg['e_dense_size'], 'encoder_h0')
+        word_w, word_b = self.dense_variable(cfg['e_dense_size'],
+                cfg['vocab_size'] * cfg['sentence_len'], 'encoder_word_dense')
+
+        e_x = tf.matmul(self.e_inputs, e_embeddings_w)
+        e_x = tf.nn.relu(tf.matmul(e_x, h0_w) + h0_b)
+        e_x = tf.matmul(e_x, word_w) + word_b
+        self.e_raw_output = tf.reshape(e_x, (cfg['population_size'], -1,
+            cfg['sentence_len'], cfg['vocab_size']))
+
+    def initialize_communication(self):
+        logits = self.e_raw_output
+        vocab_size = self.cfg['vocab_size']
+
+        def gumbel_softmax_selector():
+            dist = RelaxedOneHotCategorical(temperature=self.temperature,
+                    logits=logits)
+            sample = dist.sample()
+            y_hard = tf.one_hot(tf.argmax(sample, -1), vocab_size)
+            # y_hard is the value that gets used but the gradient flows
+            # through logits
+            y = tf.stop_gradient(y_hard - logits) + logits
+            return tf.cond(self.straight_through, lambda: y, lambda: sample)
+
+        argmax_selector = lambda: tf.one_hot(tf.argmax(logits, -1), vocab_size)
+        self.utterance = tf.cond(self.use_argmax,
+                argmax_selector,
+                gumbel_softmax_selector,
+                name="argmax_cond",
+                )
+        self.tokens = tf.argmax(self.utterance, -1)
+
+        shape = tf.shape(self.utterance)
+        self.utt_dropout = tf.layers.dropout(
+                self.utterance,
+                noise_shape=(shape[0], shape[1], self.cfg['sentence_len'], 1),
+                rate=self.dropout_rate,
+                training=tf.logical_not(self.use_argmax),
+                )
+
+    def initialize_decoder(self):
+        cfg = self.cfg
+        size = cfg['population_size']
+        flat_size = cfg['sentence_len'] * cfg['d_dense_size']
+        d_fc_w = tf.Variable(tf.initializers.truncated_normal(0., 1e-2)(
+            (size, cfg['vocab_size'], cfg['d_dense_size'])))
+        d_fc_b = tf.Variable(tf.constant(1e-1,
+            shape=(size, 1, cfg['sentence_len'], cfg['d_dense_size'])))
+        bn_gamma = tf.Variable(tf.ones((size, 1, flat_size)))
+        bn_beta = tf.Variable(tf.zeros((size, 1, flat_size)))
+        out_w, out_b = self.dense_variable(flat_size, cfg['input_dim'],
+                'decoder_output')
+        class_w, class_b = self.dense_variable(cfg['input_dim'],
+                cfg['num_concepts'], 'decoder_class')
+
+        # (P, B, L, V) x (P, V, D) -> (P, B, L, D)
+        d_x = tf.nn.relu(tf.einsum('pblv,pvd->pbld', self.utt_dropout, d_fc_w)
+                + d_fc_b)
+        d_x = tf.reshape(d_x, (size, -1, flat_size))
+        d_x = d_x / np.sqrt(1 + BN_EPSILON) * bn_gamma + bn_beta
+        d_x = tf.matmul(d_x, out_w) + out_b
+        self.d_output = tf.matmul(d_x, class_w) + class_b
+        self.d_sigmoid = tf.nn.sigmoid(self.d_output)
+
+    def initialize_graph(self):
+        with tf.name_scope("hyperparameters"):
+            self.dropout_rate = tf.placeholder(tf.float32, shape=(),
+                    name='dropout_rate')
+            self.use_argmax = tf.placeholder(tf.bool, shape=(),
+                    name='use_argmax')
+            self.temperature = tf.placeholder(tf.float32, shape=(),
+                    name='temperature')
+            self.straight_through = tf.placeholder(tf.bool, shape=(),
+                    name='straight_through')
+
+        with tf.name_scope("environment"):
+            with tf.name_scope("encoder"):
+                self.initialize_encoder()
+            with tf.name_scope("communication"):
+                self.initialize_communication()
+            with tf.name_scope("decoder"):
+                self.initialize_decoder()
+
+        with tf.name_scope("training"):
+            optmizier = tf.train.AdamOptimizer(self.cfg['learning_rate'])
+            self.loss = tf.nn.sigmoid_cross_entropy_with_logits(
+                    logits=self.d_output, labels=self.e_inputs)
+            self.member_loss = tf.reduce_mean(self.loss, axis=[1, 2])
+            for p in range(self.cfg['population_size']):
+                tf.summary.scalar(f'loss_{p}', self.member_loss[p])
+            self.example_weights = tf.placeholder_with_default(
+                    tf.ones_like(self.e_inputs[:, :, 0]),
+                    shape=(self.cfg['population_size'], None),
+                    name='example_weights',
+                    )
+            # Members share no variables, so the summed loss trains each one
+            # independently
+            self.train_step = optmizier.minimize(
+                    self.loss * self.example_weights[:, :, None])
+
+        self.init_op = tf.initializers.global_variables()
+        self.sess.run(self.init_op)
+        self.summary = tf.summary.merge_all()
+
+    def generate_train_and_test(self):
+        """Give each member its own split. A member's test set is smaller
+        than `test_prop` asks for when its train set needed more draws to
+        span the space, so every test set is trimmed to the smallest one
+        (the trimmed vectors go to train) and the splits stack along the
+        member dimension."""
+        all_input = Binary.permutations(self.cfg['num_concepts'])
+        seeds = [None if self.cfg['seed'] is None else self.cfg['seed'] + p
+                for p in range(self.cfg['population_size'])]
+        splits = [Binary.train_test_split(
+                    all_input,
+                    self.cfg['test_prop'],
+                    seed=seed,
+                    ) for seed in seeds]
+        test_size = min(len(test_i) for _, test_i in splits)
+        train_data, test_data, train_weights = [], [], []
+        for seed, (train_i, test_i) in zip(seeds, splits):
+            train_i = np.concatenate([train_i, test_i[test_size:]]).astype(int)
+            test_i = np.asarray(test_i[:test_size], dtype=int)
+            if self.cfg['weighted_examples']:
+                train_weights.append(np.full(len(train_i),
+                    self.cfg['batch_size'], dtype=np.float32))
+            else:
+                train_i = np.repeat(train_i, self.cfg['batch_size'], axis=0)
+            np.random.RandomState(seed).shuffle(train_i)
+            train_data.append(all_input[train_i])
+            test_data.append(all_input[test_i])
+
+        self.train_fd = {
+            self.e_inputs.name: np.stack(train_data),
+            self.temperature.name: self.cfg['temp_init'],
+            self.straight_through.name: self.cfg['train_st'],
+            self.dropout_rate.name: self.cfg['dropout_rate'],
+            self.use_argmax.name: False,
+        }
+        if train_weights:
+            self.train_fd[self.example_weights.name] = np.stack(train_weights)
+        self.test_fd = {
+            self.e_inputs.name: np.stack(test_data),
+            self.temperature.name: self.cfg['temp_init'], # Unused
+            self.straight_through.name: True, # Unused
+            self.dropout_rate.name: 0., # Unused
+            self.use_argmax.name: True,
+        }
+
+    def run(self, verbose=False):
+        for i in range(self.cfg['epochs']):
+            self.sess.run(self.train_step, feed_dict=self.train_fd)
+            if i % self.cfg['superepoch'] == 0:
+                self.train_fd[self.temperature.name] *= self.cfg['temp_decay']
+                superepoch = i // self.cfg['superepoch']
+                train_fd_use_argmax = {**self.train_fd,
+                        self.use_argmax.name: True}
+                summary, losses = self.sess.run(
+                        [self.summary, self.member_loss],
+                        feed_dict=train_fd_use_argmax,
+                        )
+                self.train_writer.add_summary(summary, superepoch)
+                summary = self.sess.run(self.summary, feed_dict=self.test_fd)
+                self.test_writer.add_summary(summary, superepoch)
+                if verbose:
+                    print(f"superepoch {superepoch}\ttraining loss: "
+                          + " ".join(f"{l:.3f}" for l in losses))
+
+    def test(self, verbose=False):
+        """Return the per-member average and max test loss, each of shape
+        (population_size,)."""
+        all_losses = self.sess.run(self.loss, feed_dict=self.test_fd)
+        losses = all_losses.mean(axis=-1)
+        avg, worst = losses.mean(axis=-1), losses.max(axis=-1)
+        if verbose:
+            for p in range(self.cfg['population_size']):
+                print(f"member {p}\ttest loss\t"
+                      f"avg: {avg[p]:.3f}\t"
+                      f"max: {worst[p]:.3f}")
+        return avg, worst
+
+    def utterances(self, inputs=None):
+        """Return every member's argmax utterance for `inputs` (the whole
+        concept space by default) as a (population_size, len(inputs),
+        sentence_len) token array."""
+        if inputs is None:
+            inputs = Binary.permutations(self.cfg['num_concepts'])
+        fd = {
+            **self.test_fd,
+            self.e_inputs.name: np.broadcast_to(inputs,
+                (self.cfg['population_size'],) + inputs.shape),
+        }
+        return self.sess.run(self.tokens, feed_dict=fd)
@@ -0,0 +1,76 @@
+"""Opt-in tracing of selected training steps.
+
+A traced step writes a Chrome trace (open it at chrome://tracing) to
+`<logdir>/profile/step_<i>.json`, adds its RunMetadata to a TensorBoard
+writer if one is given, and adds each op's time to the total of the
+innermost known scope in its name, so that ops in the multistep loop count
+towards the component they belong to (gradient ops count towards the scope
+the gradients were taken in, 'training'). The totals are written to
+`<logdir>/profile/scopes.json`.
+"""
+import json
+import os
+from collections import defaultdict
+
+import tensorflow as tf
+from tensorflow.python.client import timeline
+
+SCOPES = ['hyperparameters', 'encoder', 'communication', 'decoder',
+        'training', 'multistep', 'inference']
+
+
+def scope_of(node_name):
+    scope = 'other'
+    for part in node_name.split('/'):
+        # Below this are the names of the forward ops being differentiated
+        if part == 'gradients':
+            break
+        if part in SCOPES:
+            scope = part
+    return scope
+
+
+class StepProfiler:
+
+    def __init__(self, steps, logdir, writer=None):
+        self.steps = set(steps)
+        self.dir = os.path.join(logdir, 'profile')
+        self.writer = writer
+        self.scope_micros = defaultdict(int)
+        os.makedirs(self.dir, exist_ok=True)
+
+    def __contains__(self, step):
+        return step in self.steps
+
+    def covers(self, start, stop):
+        """Whether a traced step is in [start, stop)."""
+        return any(start <= step < stop for step in self.steps)
+
+    def run(self, sess, fetches, feed_dict, step):
+        """sess.run with a full trace of step `step`."""
+        metadata = tf.RunMetadata()
+        result = sess.run(fetches, feed_dict=feed_dict,
+                options=tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE),
+                run_metadata=metadata)
+        self.record(metadata, step)
+        return result
+
+    def record(self, metadata, step):
+        trace = timeline.Timeline(metadata.step_stats)
+        path = os.path.join(self.dir, f'step_{step}.json')
+        with open(path, 'w') as f:
+            f.write(trace.generate_chrome_trace_format())
+        if self.writer is not None:
+            self.writer.add_run_metadata(metadata, f'step_{step}', step)
+        for dev in metadata.step_stats.dev_stats:
+            for node in dev.node_stats:
+                self.scope_micros[scope_of(node.node_name)] += (
+                        node.all_end_rel_micros)
+        self.write_scopes()
+
+    def write_scopes(self):
+        with open(os.path.join(self.dir, 'scopes.json'), 'w') as f:
+            json.dump({
+                'steps': sorted(self.steps),
+                'micros': dict(self.scope_micros),
+                }, f, indent=2)
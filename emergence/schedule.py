@@ -0,0 +1,71 @@
+"""Compute budgeting for runs and sweeps: early stopping within a run and
+successive halving across configs."""
+import numpy as np
+
+
+class EarlyStopping:
+    """Decide at superepoch boundaries whether a run can stop, either because
+    the argmax channel has converged or because it has stopped improving."""
+
+    def __init__(self, cfg):
+        self.converged_loss = cfg['converged_loss']
+        self.patience = cfg['patience']
+        self.min_delta = cfg['min_delta']
+        self.best = np.inf
+        self.since_best = 0
+        self.reason = None
+
+    def update(self, loss, accuracy):
+        """Record the argmax-channel training loss and accuracy at a boundary
+        and return True if training should stop."""
+        if accuracy >= 1. and loss <= self.converged_loss:
+            self.reason = 'converged'
+            return True
+        if loss < self.best - self.min_delta:
+            self.best = loss
+            self.since_best = 0
+        else:
+            self.since_best += 1
+        if self.since_best >= self.patience:
+            self.reason = 'plateaued'
+            return True
+        return False
+
+
+def test_loss(cfg):
+    """Average test loss of a (possibly cached) BinaryModel run."""
+    from .cache import cached_run
+    return cached_run(cfg)['test_loss'][0]
+
+
+def successive_halving(cfgs, min_epochs, max_epochs, eta=3, run_fn=test_loss,
+        verbose=False):
+    """Evaluate every config with `min_epochs`, keep the best 1/`eta` of them,
+    multiply the budget by `eta` and repeat until one config is left or the
+    budget reaches `max_epochs`. `run_fn(cfg)` trains `cfg` and returns a
+    score to minimize.
+
+    Returns a list of (cfg, score) pairs for the final rung, best first, and
+    the number of epochs saved relative to running every config for
+    `max_epochs`."""
+    survivors = [dict(cfg) for cfg in cfgs]
+    epochs = min(min_epochs, max_epochs)
+    spent = 0
+    while True:
+        scored = []
+        for cfg in survivors:
+            scored.append(({**cfg, 'epochs': epochs}, run_fn({**cfg,
+                'epochs': epochs})))
+            spent += epochs
+        scored.sort(key=lambda pair: pair[1])
+        if verbose:
+            print(f"rung with {epochs} epochs\t{len(scored)} configs\t"
+                  f"best score: {scored[0][1]:.3f}")
+        if len(scored) == 1 or epochs >= max_epochs:
+            break
+        survivors = [cfg for cfg, _ in scored[:max(1, len(scored) // eta)]]
+        epochs = min(epochs * eta, max_epochs)
+    saved = len(cfgs) * max_epochs - spent
+    if verbose:
+        print(f"successive halving saved {saved} epochs")
+    return scored, saved
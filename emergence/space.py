@@ -0,0 +1,90 @@
+"""The binary concept space: enumerating its 2**n vectors and splitting them
+into train and test sets. Kept free of TensorFlow so that the NumPy backend,
+the cache and analysis code can use it without loading a model."""
+import numpy as np
+
+
+def span_basis_add(basis, rank, row, tol=1e-8):
+    """Add `row` to the orthonormal basis held in the first `rank` rows of
+    `basis` (Gram-Schmidt, O(n^2)) and return the new rank."""
+    v = np.asarray(row, dtype=np.float64)
+    # Project twice to keep the basis orthogonal in floating point
+    for _ in range(2):
+        v = v - basis[:rank].T @ (basis[:rank] @ v)
+    norm = np.linalg.norm(v)
+    if norm > tol:
+        basis[rank] = v / norm
+        return rank + 1
+    return rank
+
+
+def train_test_split(arr, test_split=1.0, seed=None):
+    """Roughly split the data ensuring that the train set has a span of the
+    whole space."""
+    rng = np.random if seed is None else np.random.RandomState(seed)
+    indexes = np.arange(len(arr))
+    rng.shuffle(indexes)
+    n = arr.shape[1]
+    basis = np.zeros((n, n))
+    rank = 0
+    train = []
+    pos = 0
+    # Every vector drawn before the train set spans the space goes to
+    # train; rank testing stops as soon as full rank is reached.
+    while rank < n and pos < len(indexes):
+        i = indexes[pos]
+        pos += 1
+        # The zero vector is a degenerate case, and I do not believe it
+        # is worth including
+        if not arr[i].any():
+            continue
+        rank = span_basis_add(basis, rank, arr[i])
+        train.append(i)
+
+    rest = indexes[pos:]
+    rest = rest[arr[rest].any(axis=1)]
+    # Equivalent to appending to test while len(test)/len(arr) < test_split
+    n_test = int(np.ceil(test_split * len(arr)))
+    while n_test > 0 and (n_test - 1) / len(arr) >= test_split:
+        n_test -= 1
+    while n_test / len(arr) < test_split:
+        n_test += 1
+    test = list(rest[:n_test])
+    train.extend(rest[n_test:])
+
+    return train, test
+
+
+def index_bytes(indexes, n):
+    """The little-endian bytes holding the low `n` bits of each hypercube
+    index, i.e. its binary vector bit-packed with bit i in bit i % 8 of
+    byte i // 8."""
+    indexes = np.ascontiguousarray(indexes, dtype='<u8')
+    return indexes.view(np.uint8).reshape(-1, 8)[:, :-(-n // 8)]
+
+
+def index_bits(indexes, n):
+    """Binary vectors (bit i in column i) for the given hypercube indexes."""
+    return np.unpackbits(index_bytes(indexes, n), axis=1, count=n,
+            bitorder='little')
+
+
+def permutations(n, packed=False, chunk_size=2**16):
+    """All 2**n binary vectors as a uint8 array, or bit-packed into
+    ceil(n/8) bytes per row if `packed` is set. Written into the result
+    `chunk_size` rows at a time, so the only large allocation is the
+    result itself."""
+    fill = index_bytes if packed else index_bits
+    out = np.empty((2**n, -(-n // 8) if packed else n), dtype=np.uint8)
+    for start in range(0, 2**n, chunk_size):
+        stop = min(start + chunk_size, 2**n)
+        out[start:stop] = fill(np.arange(start, stop), n)
+    return out
+
+
+def permutation_chunks(n, chunk_size=2**16):
+    """Yield the rows of `permutations(n)` in order, `chunk_size` at a
+    time, without building the whole space."""
+    for start in range(0, 2**n, chunk_size):
+        stop = min(start + chunk_size, 2**n)
+        yield index_bits(np.arange(start, stop), n)
@@ -0,0 +1,218 @@
+"""Buffered sinks for the scalar summaries written during training.
+
+The training loop only appends (split, step, values) records to an in-memory
+buffer; a background thread flushes the buffer every `flush_secs`, and
+`flush` drains it synchronously. Only `TensorBoardSink` needs TensorFlow.
+"""
+import csv
+import os
+import threading
+
+import numpy as np
+
+
+class Sink:
+    """Discards every record; also the base class of the buffered sinks."""
+
+    def scalars(self, split, step, values):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def writer(self, split):
+        """The TensorBoard FileWriter for `split`, if there is one."""
+        return None
+
+
+class BufferedSink(Sink):
+
+    def __init__(self, flush_secs=10):
+        self.flush_secs = flush_secs
+        self.buffer = []
+        self.buffer_lock = threading.Lock()
+        # Held while writing so that flush() and the thread do not interleave
+        self.write_lock = threading.Lock()
+        self.closed = threading.Event()
+        self.thread = None
+
+    def scalars(self, split, step, values):
+        record = (split, int(step), {k: float(v) for k, v in values.items()})
+        with self.buffer_lock:
+            self.buffer.append(record)
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.flush_loop,
+                    daemon=True)
+            self.thread.start()
+
+    def flush_loop(self):
+        while not self.closed.wait(self.flush_secs):
+            self.flush()
+
+    def flush(self):
+        with self.write_lock:
+            with self.buffer_lock:
+                records, self.buffer = self.buffer, []
+            if records:
+                self.write(records)
+
+    def close(self):
+        self.closed.set()
+        self.flush()
+
+    def write(self, records):
+        raise NotImplementedError
+
+
+class TensorBoardSink(BufferedSink):
+    """Event files in `logdir`/<split>, optionally with the graph in the
+    train log."""
+
+    def __init__(self, logdir, graph=None, flush_secs=10):
+        super().__init__(flush_secs)
+        import tensorflow as tf
+        self.tf = tf
+        self.logdir = logdir
+        self.graph = graph
+        self.writers = {}
+
+    def writer(self, split):
+        if split not in self.writers:
+            graph = self.graph if split == 'train' else None
+            self.writers[split] = self.tf.summary.FileWriter(
+                    os.path.join(self.logdir, split), graph)
+        return self.writers[split]
+
+    def write(self, records):
+        Summary = self.tf.Summary
+        for split, step, values in records:
+            summary = Summary(value=[Summary.Value(tag=k, simple_value=v)
+                for k, v in values.items()])
+            self.writer(split).add_summary(summary, step)
+        for writer in self.writers.values():
+            writer.flush()
+
+    def close(self):
+        super().close()
+        for writer in self.writers.values():
+            writer.close()
+
+
+class CSVSink(BufferedSink):
+    """One row per record with columns split, step and every value name seen
+    so far, appended to `path`. A name which first appears after rows have
+    been written adds a column, rewriting the file once. Without `resume`,
+    an existing file is truncated; with it, its rows are kept and a later
+    record for the same split and step replaces an earlier one."""
+
+    def __init__(self, path, flush_secs=10, resume=False):
+        super().__init__(flush_secs)
+        self.path = path
+        if resume:
+            self.fields, rows = self.read_rows()
+        else:
+            open(path, 'w').close()
+            self.fields, rows = [], []
+        self.written = {(row['split'], int(row['step'])) for row in rows}
+
+    def read_rows(self):
+        try:
+            with open(self.path, newline='') as f:
+                reader = csv.DictReader(f)
+                return list(reader.fieldnames or []), list(reader)
+        except FileNotFoundError:
+            return [], []
+
+    def write(self, records):
+        fields = list(self.fields) or ['split', 'step']
+        for _, _, values in records:
+            fields.extend(k for k in values if k not in fields)
+        replaced = {(split, step) for split, step, _ in records} & self.written
+        if self.fields and (fields != self.fields or replaced):
+            _, rows = self.read_rows()
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w', newline='') as f:
+                out = csv.DictWriter(f, fields)
+                out.writeheader()
+                out.writerows(row for row in rows
+                        if (row['split'], int(row['step'])) not in replaced)
+            os.replace(tmp, self.path)
+        new_file = not self.fields
+        self.fields = fields
+        with open(self.path, 'a', newline='') as f:
+            out = csv.DictWriter(f, self.fields)
+            if new_file:
+                out.writeheader()
+            for split, step, values in records:
+                out.writerow({'split': split, 'step': step, **values})
+                self.written.add((split, step))
+
+
+class NPZSink(BufferedSink):
+    """Every record so far as arrays '<split>/step' and '<split>/<name>' in
+    `path`, rewritten atomically on each flush. With `resume`, the records
+    already in `path` are kept; a later record for the same split and step
+    replaces an earlier one."""
+
+    def __init__(self, path, flush_secs=10, resume=False):
+        super().__init__(flush_secs)
+        self.path = path
+        self.records = {}
+        if resume and os.path.exists(path):
+            self.load()
+
+    def load(self):
+        with np.load(self.path) as data:
+            arrays = {k: data[k] for k in data.files}
+        for key, steps in arrays.items():
+            split, name = key.rsplit('/', 1)
+            if name != 'step':
+                continue
+            names = [k.rsplit('/', 1)[1] for k in arrays
+                    if k.startswith(split + '/') and k != key]
+            for i, step in enumerate(steps):
+                values = {n: float(arrays[f'{split}/{n}'][i]) for n in names}
+                self.records[split, int(step)] = {k: v
+                        for k, v in values.items() if not np.isnan(v)}
+
+    def write(self, records):
+        for split, step, values in records:
+            self.records[split, step] = values
+        arrays = {}
+        for split in sorted({split for split, _ in self.records}):
+            rows = sorted((step, values)
+                    for (s, step), values in self.records.items()
+                    if s == split)
+            arrays[f'{split}/step'] = np.array([step for step, _ in rows])
+            names = []
+            for _, values in rows:
+                names.extend(k for k in values if k not in names)
+            for name in names:
+                arrays[f'{split}/{name}'] = np.array(
+                        [values.get(name, np.nan) for _, values in rows])
+        tmp = self.path + '.tmp.npz'
+        np.savez(tmp, **arrays)
+        os.replace(tmp, self.path)
+
+
+def make_sink(cfg, logdir, graph=None):
+    """The sink selected by cfg['summary_sink']: 'tensorboard', 'csv'
+    (logdir/metrics.csv), 'npz' (logdir/metrics.npz) or None."""
+    kind = cfg['summary_sink']
+    flush_secs = cfg['summary_flush_secs']
+    if kind is None:
+        return Sink()
+    if kind == 'tensorboard':
+        return TensorBoardSink(logdir,
+                graph if cfg['summary_graph'] else None, flush_secs)
+    os.makedirs(logdir, exist_ok=True)
+    if kind == 'csv':
+        return CSVSink(os.path.join(logdir, 'metrics.csv'), flush_secs,
+                cfg['resume'])
+    if kind == 'npz':
+        return NPZSink(os.path.join(logdir, 'metrics.npz'), flush_secs,
+                cfg['resume'])
+    raise ValueError(f"unknown summary_sink {kind!r}")
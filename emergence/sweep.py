@@ -0,0 +1,324 @@
+"""Sharded, resumable sweeps over BinaryModel configs.
+
+A sweep directory holds
+
+    manifest.jsonl   one {"id", "cfg"} object per run, written by `init`
+    claims/<id>      claim files of runs in progress, naming their owner
+    claims/<id>.lock flock targets serializing changes to claims/<id>
+    runs/<id>/       each run's log directory, checkpoints and result.json
+
+Any number of workers, on any machine sharing the directory, claim runs by
+writing their claim file while holding an exclusive flock on the run's lock
+file. A worker touches its claim file while the run trains; a claim file
+older than `expire_secs` belongs to a crashed worker and is taken over, and
+the run resumes from its last checkpoint. Each claim holds a random token,
+and a worker only removes a claim which still holds its own token.
+
+    python -m emergence.sweep init spec.json sweeps/name
+    python -m emergence.sweep work sweeps/name [--wait]
+    python -m emergence.sweep status sweeps/name
+    python -m emergence.sweep aggregate sweeps/name
+
+A spec has a `base` config, a `grid` of values to take the product of, and
+optionally `random` distributions ({"uniform": [low, high]},
+{"loguniform": [low, high]}, {"randint": [low, high]} or {"choice": [...]})
+drawn `samples` times per grid point with the spec's `seed`, and a list of
+`seeds` to repeat every config with.
+"""
+import argparse
+import contextlib
+import fcntl
+import itertools
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+import numpy as np
+
+DISTRIBUTIONS = {
+    'uniform': lambda rng, args: float(rng.uniform(*args)),
+    'loguniform': lambda rng, args: float(np.exp(
+        rng.uniform(np.log(args[0]), np.log(args[1])))),
+    'randint': lambda rng, args: int(rng.randint(args[0], args[1] + 1)),
+    'choice': lambda rng, args: args[rng.randint(len(args))],
+}
+
+
+def expand(spec):
+    """The list of run configs described by `spec`."""
+    grid = spec.get('grid', {})
+    points = [dict(zip(grid, values))
+            for values in itertools.product(*grid.values())]
+    random = spec.get('random', {})
+    if random:
+        rng = np.random.RandomState(spec.get('seed', 0))
+        points = [{**point, **{k: DISTRIBUTIONS[kind](rng, args)
+            for k, dist in random.items() for kind, args in dist.items()}}
+            for point in points for _ in range(spec.get('samples', 1))]
+    seeds = spec.get('seeds', [None])
+    return [{**spec.get('base', {}), **point, 'seed': seed}
+            for point in points for seed in seeds]
+
+
+def write_atomic(path, text):
+    tmp = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def init(spec, root):
+    """Write the manifest of `spec` to the sweep directory `root`; an
+    existing identical manifest is left alone."""
+    lines = ''.join(json.dumps({'id': f'{i:05d}', 'cfg': cfg}) + '\n'
+            for i, cfg in enumerate(expand(spec)))
+    path = os.path.join(root, 'manifest.jsonl')
+    if os.path.exists(path):
+        with open(path) as f:
+            if f.read() != lines:
+                raise ValueError(f"{path} exists with a different manifest")
+        return
+    os.makedirs(os.path.join(root, 'claims'), exist_ok=True)
+    os.makedirs(os.path.join(root, 'runs'), exist_ok=True)
+    write_atomic(path, lines)
+
+
+def load_manifest(root):
+    with open(os.path.join(root, 'manifest.jsonl')) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def result_path(root, run_id):
+    return os.path.join(root, 'runs', run_id, 'result.json')
+
+
+def claim_path(root, run_id):
+    return os.path.join(root, 'claims', run_id)
+
+
+def is_done(root, run_id):
+    return os.path.exists(result_path(root, run_id))
+
+
+@contextlib.contextmanager
+def claim_lock(path):
+    """Hold an exclusive flock on the lock file of the claim at `path`. The
+    lock files are never removed, since removing one under a lock would let
+    two workers lock different files."""
+    with open(path + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def claim_token(path):
+    """The token of the claim at `path`, or None if there is none."""
+    try:
+        with open(path) as f:
+            return json.load(f).get('token')
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def claim(root, run_id, expire_secs):
+    """Try to claim a run, taking over a claim older than `expire_secs`.
+    Returns this process's token for the claim, or None if another worker
+    holds it."""
+    path = claim_path(root, run_id)
+    token = uuid.uuid4().hex
+    # Checking the age and writing the claim under one lock means that of
+    # several workers taking over the same claim, only the first sees it
+    # stale
+    with claim_lock(path):
+        try:
+            age = time.time() - os.stat(path).st_mtime
+        except FileNotFoundError:
+            age = None
+        if age is not None and age < expire_secs:
+            return None
+        write_atomic(path, json.dumps({'token': token,
+            'host': socket.gethostname(), 'pid': os.getpid(),
+            'time': time.time()}))
+    return token
+
+
+def release(root, run_id, token):
+    """Remove a claim if it still holds `token`."""
+    path = claim_path(root, run_id)
+    with claim_lock(path):
+        if claim_token(path) == token:
+            os.remove(path)
+
+
+class Heartbeat:
+    """Touch a claim file every `interval` seconds until stopped or until
+    the claim no longer holds `token`."""
+
+    def __init__(self, path, token, interval):
+        self.path = path
+        self.token = token
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.beat, daemon=True)
+        self.thread.start()
+
+    def beat(self):
+        while not self.stopped.wait(self.interval):
+            if claim_token(self.path) != self.token:
+                return
+            try:
+                os.utime(self.path)
+            except FileNotFoundError:
+                return
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+def run_one(root, entry, checkpoint_every):
+    """Train one manifest entry in its own log directory and write its
+    result.json."""
+    from .launcher import get_model
+
+    logdir = os.path.join(root, 'runs', entry['id'])
+    os.makedirs(logdir, exist_ok=True)
+    cfg = {
+        'summary_sink': 'npz',
+        'summary_graph': False,
+        'checkpoint_every': checkpoint_every,
+        'resume': True,
+        **entry['cfg'],
+    }
+    start = time.perf_counter()
+    model = get_model(cfg, logdir)
+    model.run()
+    avg, worst = model.test()
+    model.freeze(os.path.join(logdir, 'frozen.npz'))
+    model.close()
+    result = {
+        'id': entry['id'],
+        'cfg': entry['cfg'],
+        'test_loss': float(avg),
+        'test_loss_max': float(worst),
+        'epochs_run': int(model.epochs_run),
+        'steps_per_sec': float(model.steps_per_sec),
+        'seconds': time.perf_counter() - start,
+        'host': socket.gethostname(),
+    }
+    write_atomic(result_path(root, entry['id']), json.dumps(result))
+    return result
+
+
+def work(root, expire_secs=600, checkpoint_every=5, wait=False,
+        poll_secs=30, verbose=False):
+    """Claim and train runs until none is left unclaimed; with `wait`, until
+    every run is done. Returns the number of runs trained."""
+    manifest = load_manifest(root)
+    # Start at a different offset on each worker to spread the claims
+    offset = uuid.uuid4().int % max(len(manifest), 1)
+    manifest = manifest[offset:] + manifest[:offset]
+    trained = 0
+    while True:
+        pending = [e for e in manifest if not is_done(root, e['id'])]
+        if not pending:
+            return trained
+        claimed = False
+        for entry in pending:
+            if is_done(root, entry['id']):
+                continue
+            token = claim(root, entry['id'], expire_secs)
+            if token is None:
+                continue
+            claimed = True
+            heartbeat = Heartbeat(claim_path(root, entry['id']), token,
+                    expire_secs / 4)
+            try:
+                if not is_done(root, entry['id']):
+                    result = run_one(root, entry, checkpoint_every)
+                    trained += 1
+                    if verbose:
+                        print(f"run {entry['id']}\t"
+                              f"test loss: {result['test_loss']:.3f}")
+            finally:
+                heartbeat.stop()
+                release(root, entry['id'], token)
+        if not claimed:
+            if not wait:
+                return trained
+            time.sleep(poll_secs)
+
+
+def status(root):
+    """Counts of done, claimed and pending runs."""
+    manifest = load_manifest(root)
+    done = sum(is_done(root, e['id']) for e in manifest)
+    claimed = sum(os.path.exists(claim_path(root, e['id']))
+            and not is_done(root, e['id']) for e in manifest)
+    return {'runs': len(manifest), 'done': done, 'claimed': claimed,
+            'pending': len(manifest) - done - claimed}
+
+
+def aggregate(root, path=None):
+    """Merge every result.json into one columnar .npz file (default
+    `root`/results.npz), one array per config key and metric."""
+    results = []
+    for entry in load_manifest(root):
+        try:
+            with open(result_path(root, entry['id'])) as f:
+                results.append(json.load(f))
+        except FileNotFoundError:
+            pass
+    rows = [{'id': r.pop('id'), **r.pop('cfg'), **r} for r in results]
+    columns = sorted({k for row in rows for k in row})
+    arrays = {}
+    for k in columns:
+        values = [row.get(k) for row in rows]
+        if any(isinstance(v, (dict, list)) for v in values):
+            values = [json.dumps(v) for v in values]
+        elif any(v is None for v in values) or any(
+                isinstance(v, str) for v in values):
+            values = ['' if v is None else str(v) for v in values]
+        arrays[k] = np.array(values)
+    if path is None:
+        path = os.path.join(root, 'results.npz')
+    np.savez(path, **arrays)
+    return path, len(rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    init_parser = commands.add_parser('init')
+    init_parser.add_argument('spec')
+    init_parser.add_argument('root')
+    work_parser = commands.add_parser('work')
+    work_parser.add_argument('root')
+    work_parser.add_argument('--expire-secs', type=float, default=600)
+    work_parser.add_argument('--checkpoint-every', type=int, default=5,
+            help="superepochs between checkpoints")
+    work_parser.add_argument('--wait', action='store_true',
+            help="wait for runs claimed by other workers")
+    status_parser = commands.add_parser('status')
+    status_parser.add_argument('root')
+    aggregate_parser = commands.add_parser('aggregate')
+    aggregate_parser.add_argument('root')
+    aggregate_parser.add_argument('--out', default=None)
+    args = parser.parse_args()
+
+    if args.command == 'init':
+        with open(args.spec) as f:
+            init(json.load(f), args.root)
+        print(f"{len(load_manifest(args.root))} runs in {args.root}")
+    elif args.command == 'work':
+        trained = work(args.root, args.expire_secs, args.checkpoint_every,
+                args.wait, verbose=True)
+        print(f"trained {trained} runs")
+    elif args.command == 'status':
+        print(status(args.root))
+    else:
+        path, count = aggregate(args.root, args.out)
+        print(f"{count} runs -> {path}")
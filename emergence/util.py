@@ -1,8 +1,13 @@
 import numpy as np
 
-def ohvs_to_words(ohvs):
-    sentence = ""
-    for v in ohvs:
-        sentence += chr(ord('a')+np.argmax(v))
-    return sentence
+def tokens_to_words(tokens):
+    """Convert a (batch, sentence_len) token array into an array of strings,
+    token k becoming the k-th letter of the alphabet."""
+    tokens = np.asarray(tokens, dtype=np.uint8)
+    letters = np.ascontiguousarray(tokens + ord('a'))
+    return letters.view(f'S{tokens.shape[-1]}')[..., 0].astype(str)
 
+def ohvs_to_words(ohvs):
+    """Convert one-hot vectors (..., sentence_len, vocab_size) into words."""
+    words = tokens_to_words(np.argmax(ohvs, -1))
+    return words if words.ndim else str(words)
@@ -1,9 +1,7 @@
 import os
-import shutil
-
-import tensorflow as tf
 
 import emergence as em
+from emergence.defaults import BINARY_CFG
 
 
 def run_binary_model():
@@ -14,13 +12,18 @@ def run_binary_model():
         'test_prop': 0.2,
         'e_dense_size': 20,
         'sentence_len': 6,
+        # Fixed so that a repeated run loads its cached result
+        'seed': 0,
+        'checkpoint_every': 5,
+        'resume': True,
     }
-    logdir = 'log'
-    if os.path.isdir(logdir):
-        shutil.rmtree(logdir)
-    model = em.BinaryModel(cfg=model_cfg, logdir=logdir)
-    model.run(verbose=True)
-    model.test(verbose=True)
+    # One log directory per config, so an interrupted run resumes from its
+    # own checkpoints
+    key = em.ResultCache.key({**BINARY_CFG, **model_cfg})
+    logdir = os.path.join('log', key[:12])
+    result = em.cached_run(model_cfg, logdir=logdir, verbose=True)
+    avg, worst = result['test_loss']
+    print(f"test loss\tavg: {avg:.3f}\tmax: {worst:.3f}")
     #model.output_test_space(verbose=True)
 
 if __name__ == '__main__':